@@ -0,0 +1,85 @@
+from collections.abc import Mapping
+from typing import (Dict, FrozenSet, Iterator, List, Sequence, Set,
+                    Tuple)
+
+from standings import TeamIds
+
+MatchKey = Tuple[str, int]
+
+
+class Availabilities(Mapping):
+    """Players available to every team by (stage, match number), read like a
+    dict of {team: players}. Also indexed by stage => match number => team =>
+    bitmask over interned player ids, so checking that a roster is available
+    is a subset test, and by stage => teams."""
+
+    def __init__(self, availabilities: Mapping = None) -> None:
+        super().__init__()
+
+        self.player_ids = TeamIds()
+        self.masks = {}
+        self._availabilities = {}
+        self._stage_teams = {}
+        self._roster_masks = {}
+
+        if availabilities is not None:
+            for key, team_members in availabilities.items():
+                self._add(key, team_members)
+
+    def __getitem__(self, key: MatchKey) -> Dict[str, Set[str]]:
+        return self._availabilities[key]
+
+    def __iter__(self) -> Iterator[MatchKey]:
+        return iter(self._availabilities)
+
+    def __len__(self) -> int:
+        return len(self._availabilities)
+
+    def mask(self, stage: str, match_number: int, team: str) -> int:
+        """Return the bitmask of the players available to a team in a
+        match. Raise KeyError if the match is unknown."""
+        return self.masks[stage][match_number].get(team, 0)
+
+    def roster_mask(self, roster: Sequence[str]) -> int:
+        """Return the bitmask of the players of a roster, memoized."""
+        roster = tuple(roster)
+        mask = self._roster_masks.get(roster)
+        if mask is None:
+            mask = 0
+            for name in roster:
+                mask |= 1 << self.player_ids[name]
+            self._roster_masks[roster] = mask
+        return mask
+
+    def available(self, roster: Sequence[str], mask: int) -> bool:
+        """Return whether all the players of a roster are in a mask."""
+        roster_mask = self.roster_mask(roster)
+        return roster_mask & mask == roster_mask
+
+    def players(self, mask: int) -> List[str]:
+        """Return the names of the players of a bitmask, in id order."""
+        names = []
+        while mask:
+            bit = mask & -mask
+            names.append(self.player_ids.teams[bit.bit_length() - 1])
+            mask ^= bit
+        return names
+
+    def stage_teams(self, stage: str) -> FrozenSet[str]:
+        """Return the teams with players available in a stage."""
+        return self._stage_teams.get(stage, frozenset())
+
+    def _add(self, key: MatchKey, team_members: Mapping) -> None:
+        stage, match_number = key
+        self._availabilities[key] = team_members
+
+        team_masks = {}
+        for team, members in team_members.items():
+            mask = 0
+            for name in members:
+                mask |= 1 << self.player_ids[name]
+            team_masks[team] = mask
+
+        self.masks.setdefault(stage, {})[match_number] = team_masks
+        self._stage_teams[stage] = (self._stage_teams.get(stage, frozenset())
+                                    | frozenset(team_members))
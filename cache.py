@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import (Any, Callable, Hashable, Iterable, Iterator, Optional,
+                    Tuple)
+
+
+class LRUCache(object):
+    """Mapping of a bounded size, evicting the least recently used keys.
+    Count hits & misses of lookups."""
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        super().__init__()
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the value of key, calling compute() to get it on a miss."""
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            self.put(key, value)
+        else:
+            self.hits += 1
+            self._items.move_to_end(key)
+
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class RawCache(object):
+    """Store of JSON documents on disk by key. Documents are compressed and
+    addressed by the digest of their content, so identical ones are stored
+    once. Entries expire ttl seconds after they were last stored or touched,
+    and the least recent ones are evicted past max_bytes, when saved."""
+
+    def __init__(self, directory: str, ttl: float = 30 * 24 * 3600,
+                 max_bytes: int = 256 * 2 ** 20) -> None:
+        super().__init__()
+
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # key => [digest, time stored or touched]
+        self._index = {}
+        index_filename = self._index_filename()
+        if os.path.exists(index_filename):
+            with open(index_filename) as index_file:
+                self._index = json.load(index_file)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return str(key) in self._index
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._index.get(str(key))
+        if entry is None:
+            return None
+        return self._read(entry[0])
+
+    def put(self, key: Hashable, document: Any) -> str:
+        """Store a document, return its digest."""
+        text = json.dumps(document, sort_keys=True, separators=(',', ':'))
+        digest = hashlib.sha1(text.encode()).hexdigest()
+
+        filename = self._object_filename(digest)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with gzip.open(filename + '.tmp', 'wt') as file:
+                file.write(text)
+            os.replace(filename + '.tmp', filename)
+
+        self._index[str(key)] = [digest, time.time()]
+        return digest
+
+    def touch(self, keys: Iterable[Hashable]) -> None:
+        """Renew the entries of the given keys, as if they were stored."""
+        now = time.time()
+        for key in keys:
+            entry = self._index.get(str(key))
+            if entry is not None:
+                entry[1] = now
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key, (digest, _) in list(self._index.items()):
+            yield key, self._read(digest)
+
+    def evict(self) -> None:
+        """Drop the expired entries, then the least recent ones while the
+        documents take more than max_bytes, and delete unused documents."""
+        expired = time.time() - self.ttl
+        self._index = {key: entry for key, entry in self._index.items()
+                       if entry[1] >= expired}
+
+        sizes = {}
+        for digest, _ in self._index.values():
+            if digest not in sizes:
+                filename = self._object_filename(digest)
+                sizes[digest] = (os.path.getsize(filename)
+                                 if os.path.exists(filename) else 0)
+        n_bytes = sum(sizes.values())
+
+        n_keys = Counter(digest for digest, _ in self._index.values())
+        # The most recent entries come first.
+        entries = sorted(self._index.items(), key=lambda item: -item[1][1])
+        while n_bytes > self.max_bytes and entries:
+            key, (digest, _) = entries.pop()
+            del self._index[key]
+            n_keys[digest] -= 1
+            if not n_keys[digest]:
+                n_bytes -= sizes[digest]
+
+        used = {digest for digest, _ in self._index.values()}
+        objects_dir = os.path.join(self.directory, 'objects')
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for filename in filenames:
+                if filename.split('.')[0] not in used:
+                    os.remove(os.path.join(dirpath, filename))
+
+    def save(self) -> None:
+        """Evict entries & write the index."""
+        self.evict()
+
+        os.makedirs(self.directory, exist_ok=True)
+        index_filename = self._index_filename()
+        with open(index_filename + '.tmp', 'w') as index_file:
+            json.dump(self._index, index_file)
+        os.replace(index_filename + '.tmp', index_filename)
+
+    def _read(self, digest: str) -> Any:
+        with gzip.open(self._object_filename(digest), 'rt') as file:
+            return json.load(file)
+
+    def _index_filename(self) -> str:
+        return os.path.join(self.directory, 'index.json')
+
+    def _object_filename(self, digest: str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2],
+                            digest + '.json.gz')
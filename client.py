@@ -0,0 +1,330 @@
+import asyncio
+import codecs
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+
+# Statuses worth retrying, the others are returned or raised as they are.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class APIClient(object):
+    """Client of the API, which runs blocking requests in a pool of threads
+    sharing one session, so connections are kept alive & reused.
+    Failed requests are retried with exponential backoff and full jitter
+    until their deadline. Concurrent requests of pages and of single matches
+    are limited separately."""
+
+    def __init__(self, base_url: str, concurrency: int = 4,
+                 match_concurrency: int = 8, timeout: float = 10.0,
+                 deadline: float = 60.0, retries: int = 5,
+                 backoff: float = 0.5,
+                 session: requests.Session = None) -> None:
+        super().__init__()
+
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.match_concurrency = match_concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+
+        n_workers = concurrency + match_concurrency
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._executor = ThreadPoolExecutor(n_workers)
+
+    def __enter__(self) -> 'APIClient':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self.session.close()
+
+    async def get(self, path: str, params: Dict = None, headers: Dict = None,
+                  semaphore: asyncio.Semaphore = None,
+                  stream: bool = False) -> requests.Response:
+        """Request a path of the API, retrying on connection errors,
+        timeouts and transient statuses. Raise the last error once retries
+        are exhausted or the deadline would be passed.
+        With stream, the body is left to be read from the response."""
+        loop = asyncio.get_running_loop()
+        url = self.base_url + path
+        give_up = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            # Never wait on a connection or a response past the deadline.
+            timeout = min(self.timeout, give_up - time.monotonic())
+            error = None
+            response = None
+            try:
+                if semaphore is not None:
+                    async with semaphore:
+                        response = await loop.run_in_executor(
+                            self._executor, self._get, url, params, headers,
+                            timeout, stream)
+                else:
+                    response = await loop.run_in_executor(
+                        self._executor, self._get, url, params, headers,
+                        timeout, stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if response is not None:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                response.close()
+                error = requests.HTTPError(
+                    f'{response.status_code} for {response.url}',
+                    response=response)
+
+            attempt += 1
+            delay = self._delay(attempt, response)
+            if attempt > self.retries or \
+                    time.monotonic() + delay >= give_up:
+                raise error
+            await asyncio.sleep(delay)
+
+    async def get_json(self, path: str, params: Dict = None,
+                       semaphore: asyncio.Semaphore = None) -> Dict:
+        response = await self.get(path, params, semaphore=semaphore)
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_pages(self, page_size: int,
+                          pages: Dict[str, Dict] = None
+                          ) -> AsyncIterator[Dict]:
+        """Yield the raw matches of every page of the API one by one, as
+        they are decoded from the bodies of the pages, which are never held
+        in memory as a whole. Pages are interleaved.
+        pages holds the validators of the pages by page number. When given,
+        the pages known from them are requested together & conditionally,
+        the ones not modified since are skipped, and the validators are
+        updated."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Bounded, so the pages are not read faster than they are used.
+        queue = asyncio.Queue(self.concurrency)
+        n_known = len(pages) if pages else 1
+        tasks = {page: asyncio.ensure_future(self._stream_page(
+                     page, page_size, pages, semaphore, queue))
+                 for page in range(n_known)}
+        next_page = n_known
+        last_page = None
+
+        try:
+            while tasks:
+                page, raw_match = await queue.get()
+                if raw_match is not None:
+                    yield raw_match
+                    continue
+
+                # The page is over.
+                last = await tasks.pop(page)
+                if last:
+                    if last_page is None or page < last_page:
+                        last_page = page
+                elif last_page is None and page + 1 == next_page:
+                    tasks[next_page] = asyncio.ensure_future(
+                        self._stream_page(next_page, page_size, pages,
+                                          semaphore, queue))
+                    next_page += 1
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        if pages is not None:
+            # Forget the pages past the last one.
+            for key in [key for key in pages if int(key) > last_page]:
+                del pages[key]
+
+    async def fetch_matches(self, match_ids: Iterable[int]
+                            ) -> AsyncIterator[Dict]:
+        """Yield the raw matches of the given ids as they arrive."""
+        semaphore = asyncio.Semaphore(self.match_concurrency)
+        tasks = [asyncio.ensure_future(
+                     self.get_json(f'matches/{match_id}', semaphore=semaphore))
+                 for match_id in match_ids]
+
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # Retrieved, it is not logged.
+
+    async def _stream_page(self, page: int, page_size: int,
+                           pages: Optional[Dict[str, Dict]],
+                           semaphore: asyncio.Semaphore,
+                           queue: asyncio.Queue) -> bool:
+        """Put the raw matches of a page into the queue, followed by None.
+        Return whether the page is the last one."""
+        try:
+            return await self._decode_page(page, page_size, pages,
+                                           semaphore, queue)
+        finally:
+            await queue.put((page, None))
+
+    async def _decode_page(self, page: int, page_size: int,
+                           pages: Optional[Dict[str, Dict]],
+                           semaphore: asyncio.Semaphore,
+                           queue: asyncio.Queue) -> bool:
+        params = {'page': page, 'size': page_size}
+        headers = {}
+        validators = pages.get(str(page)) if pages is not None else None
+        if validators is not None:
+            if validators['etag']:
+                headers['If-None-Match'] = validators['etag']
+            if validators['last_modified']:
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        async with semaphore:
+            response = await self.get('matches', params, headers,
+                                      stream=True)
+            with response:
+                if response.status_code == 304 and validators is not None:
+                    return validators['last']
+                response.raise_for_status()
+
+                loop = asyncio.get_running_loop()
+                fields = {}
+                raw_matches = decode_page(
+                    response.iter_content(CHUNK_SIZE), fields)
+                match_ids = []
+                while True:
+                    raw_match = await loop.run_in_executor(
+                        self._executor, next, raw_matches, None)
+                    if raw_match is None:
+                        break
+                    await queue.put((page, raw_match))
+                    match_ids.append(raw_match['id'])
+
+        # Without paging information, the API returned everything.
+        last = fields.get('last', True) or not match_ids
+
+        if pages is not None:
+            pages[str(page)] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'last': last,
+                'match_ids': match_ids
+            }
+        return last
+
+    def _get(self, url: str, params: Optional[Dict],
+             headers: Optional[Dict], timeout: float,
+             stream: bool) -> requests.Response:
+        return self.session.get(url, params=params, headers=headers,
+                                timeout=max(timeout, 0.001), stream=stream)
+
+    def _delay(self, attempt: int, response: requests.Response) -> float:
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+
+        return random.uniform(0, self.backoff * 2 ** (attempt - 1))
+
+
+def decode_page(chunks: Iterable[bytes], fields: Dict) -> Iterator[Dict]:
+    """Yield the items of the content array of a page of the API one by one,
+    decoding them from chunks of its JSON body. The other fields of the page
+    are stored into fields once they are decoded."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    text = ''
+    pos = 0
+    eof = False
+
+    def read() -> None:
+        nonlocal text, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            text = text[pos:] + utf8.decode(b'', final=True)
+        else:
+            text = text[pos:] + utf8.decode(chunk)
+        pos = 0
+
+    def peek() -> str:
+        # Return the next character past whitespace, without consuming it.
+        nonlocal pos
+        while True:
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos < len(text):
+                return text[pos]
+            if eof:
+                raise ValueError('Unexpected end of the page')
+            read()
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f'Expected {char!r} at {text[pos:pos + 20]!r}')
+        pos += 1
+
+    def value():
+        nonlocal pos
+        while True:
+            peek()
+            try:
+                result, end = decoder.raw_decode(text, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number may go on in the next chunk, even past a
+                # prefix which decodes, like 1. or 1.5e.
+                if eof or (end < len(text) and
+                           text[end] not in '0123456789.eE+-'):
+                    pos = end
+                    return result
+
+            # Double the text to decode, values spanning many chunks are
+            # decoded again only a logarithmic number of times.
+            n_chars = len(text) - pos
+            while not eof and len(text) - pos < 2 * n_chars:
+                read()
+
+    expect('{')
+    first_key = True
+    while peek() != '}':
+        if not first_key:
+            expect(',')
+        first_key = False
+        key = value()
+        expect(':')
+
+        if key != 'content':
+            fields[key] = value()
+            continue
+
+        expect('[')
+        first_item = True
+        while peek() != ']':
+            if not first_item:
+                expect(',')
+            first_item = False
+            yield value()
+        expect(']')
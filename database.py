@@ -0,0 +1,281 @@
+import sqlite3
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+from typing import (Collection, Dict, Iterable, Iterator, List, Sequence,
+                    Set, Tuple)
+
+from trueskill import Rating
+
+from game import Game
+
+DATABASE = 'owl.db'
+BATCH_SIZE = 1000
+
+# Columns of the games table, in the order of the fields of CSVGame.
+GAME_COLUMNS = (
+    'match_id', 'stage', 'start_time', 'team1', 'team2', 'match_format',
+    'game_id', 'game_number', 'map_name', 'score1', 'score2',
+    'team1_p1', 'team1_p2', 'team1_p3', 'team1_p4', 'team1_p5', 'team1_p6',
+    'team2_p1', 'team2_p2', 'team2_p3', 'team2_p4', 'team2_p5', 'team2_p6'
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS games (
+    match_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    team1 TEXT NOT NULL,
+    team2 TEXT NOT NULL,
+    match_format TEXT NOT NULL,
+    game_id INTEGER UNIQUE,
+    game_number INTEGER,
+    map_name TEXT,
+    score1 INTEGER,
+    score2 INTEGER,
+    {', '.join(f'{column} TEXT' for column in GAME_COLUMNS[11:])}
+);
+CREATE INDEX IF NOT EXISTS games_match_id ON games (match_id);
+CREATE INDEX IF NOT EXISTS games_stage ON games (stage, start_time);
+CREATE INDEX IF NOT EXISTS games_start_time ON games (start_time);
+CREATE INDEX IF NOT EXISTS games_team1 ON games (team1);
+CREATE INDEX IF NOT EXISTS games_team2 ON games (team2);
+
+-- The players of every game, one per row, so they can be indexed.
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    team TEXT NOT NULL,
+    player TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS game_players_player ON game_players (player);
+CREATE INDEX IF NOT EXISTS game_players_match_id
+    ON game_players (match_id);
+
+CREATE TABLE IF NOT EXISTS availabilities (
+    stage TEXT NOT NULL,
+    match_number INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    team TEXT NOT NULL,
+    PRIMARY KEY (stage, match_number, player)
+);
+CREATE INDEX IF NOT EXISTS availabilities_player ON availabilities (player);
+CREATE INDEX IF NOT EXISTS availabilities_team ON availabilities (team);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    stage TEXT NOT NULL,
+    match_number INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    mu REAL NOT NULL,
+    sigma REAL NOT NULL,
+    PRIMARY KEY (stage, match_number, name)
+);
+CREATE INDEX IF NOT EXISTS ratings_name ON ratings (name);
+"""
+
+
+class Database(object):
+    """SQLite store of games, availabilities and ratings history, an
+    alternative to the csv files of fetcher. The database is in WAL mode,
+    so it can be read while it is written. Rows are written in batches,
+    each call in a single transaction."""
+
+    def __init__(self, filename: str = DATABASE) -> None:
+        super().__init__()
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'Database':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def save_games(self, games: Iterable[Sequence]) -> None:
+        """Replace all the games by the given CSVGames."""
+        with self.connection:
+            self.connection.execute('DELETE FROM games')
+            self.connection.execute('DELETE FROM game_players')
+            self._insert_games(games)
+
+    def upsert_games(self, changed: Dict[int, List[Sequence]]) -> None:
+        """Replace the games of the changed matches by the given CSVGames,
+        see fetcher.merge_games."""
+        match_ids = [(match_id,) for match_id in changed]
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM games WHERE match_id = ?', match_ids)
+            self.connection.executemany(
+                'DELETE FROM game_players WHERE match_id = ?', match_ids)
+            self._insert_games(game for games in changed.values()
+                               for game in games)
+
+    def iter_games(self, stage: str = None, start: datetime = None,
+                   end: datetime = None, match_ids: Collection[int] = None,
+                   played: bool = None, player: str = None,
+                   team: str = None) -> Iterator[Game]:
+        """Yield the games matching all the given filters in order, see
+        fetcher.iter_games. Also filter the games a player played, or the
+        games of a team."""
+        conditions = []
+        params = []
+
+        if played is not None:
+            conditions.append('game_id IS NOT NULL' if played else
+                              'game_id IS NULL')
+        if stage is not None:
+            conditions.append('stage = ?')
+            params.append(stage)
+        if start is not None:
+            conditions.append('start_time >= ?')
+            params.append(_time_text(start))
+        if end is not None:
+            conditions.append('start_time < ?')
+            params.append(_time_text(end))
+        if match_ids is not None:
+            match_ids = list(match_ids)
+            conditions.append(
+                f'match_id IN ({", ".join("?" * len(match_ids))})')
+            params += match_ids
+        if player is not None:
+            conditions.append('game_id IN (SELECT game_id FROM game_players '
+                              'WHERE player = ?)')
+            params.append(player)
+        if team is not None:
+            conditions.append('(team1 = ? OR team2 = ?)')
+            params += [team, team]
+
+        query = f'SELECT {", ".join(GAME_COLUMNS)} FROM games'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start_time, match_id, rowid'
+
+        for row in self.connection.execute(query, params):
+            yield _row_game(row)
+
+    def load_games(self) -> Tuple[List[Game], List[Game]]:
+        """Load past & future games."""
+        past_games = []
+        future_games = []
+
+        for game in self.iter_games():
+            if game.game_id is not None:
+                past_games.append(game)
+            else:
+                future_games.append(game)
+
+        return past_games, future_games
+
+    def save_availabilities(
+            self, availabilities: Dict[Tuple[str, int], Dict[str, Set[str]]]
+            ) -> None:
+        """Replace the availabilities of the given matches of teams."""
+        keys = list(availabilities.keys())
+        rows = ((stage, match_number, name, team)
+                for (stage, match_number), team_members
+                in availabilities.items()
+                for team, members in team_members.items()
+                for name in members)
+
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM availabilities '
+                'WHERE stage = ? AND match_number = ?', keys)
+            self._insert_batches(
+                'INSERT INTO availabilities VALUES (?, ?, ?, ?)', rows)
+
+    def load_availabilities(
+            self) -> Dict[Tuple[str, int], Dict[str, Set[str]]]:
+        availabilities = {}
+        rows = self.connection.execute(
+            'SELECT stage, match_number, player, team FROM availabilities '
+            'ORDER BY rowid')
+
+        for stage, match_number, name, team in rows:
+            key = (stage, match_number)
+            if key not in availabilities:
+                availabilities[key] = defaultdict(set)
+            availabilities[key][team].add(name)
+
+        return availabilities
+
+    def save_ratings_history(self, history: Dict) -> None:
+        """Upsert the ratings of a history, see RatingsHistory. Unlike the
+        csv file, only the ratings recorded at a match are stored."""
+        rows = ((stage, match_number, name, rating.mu, rating.sigma)
+                for (stage, match_number), ratings in history.items()
+                for name, rating in ratings.items())
+
+        with self.connection:
+            self._insert_batches(
+                'INSERT INTO ratings VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (stage, match_number, name) DO UPDATE '
+                'SET mu = excluded.mu, sigma = excluded.sigma', rows)
+
+    def load_ratings_history(self) -> Dict[Tuple[str, int], Dict]:
+        history = OrderedDict()
+        rows = self.connection.execute(
+            'SELECT stage, match_number, name, mu, sigma FROM ratings '
+            'ORDER BY rowid')
+
+        for stage, match_number, name, mu, sigma in rows:
+            key = (stage, match_number)
+            if key not in history:
+                history[key] = {}
+            history[key][name] = Rating(mu=mu, sigma=sigma)
+
+        return history
+
+    def _insert_games(self, games: Iterable[Sequence]) -> None:
+        player_rows = []
+
+        def game_rows() -> Iterator[Tuple]:
+            for game in games:
+                row = tuple(None if value == '' else value
+                            for value in game)
+                row = row[:2] + (_time_text(row[2]),) + row[3:]
+                if row[6] is not None:
+                    player_rows.extend(
+                        (row[6], row[0], row[3 + i // 6], name)
+                        for i, name in enumerate(row[11:]))
+                yield row
+
+        self._insert_batches(
+            f'INSERT INTO games VALUES '
+            f'({", ".join("?" * len(GAME_COLUMNS))})', game_rows())
+        self._insert_batches(
+            'INSERT INTO game_players VALUES (?, ?, ?, ?)', player_rows)
+
+    def _insert_batches(self, sql: str, rows: Iterable[Tuple]) -> None:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                self.connection.executemany(sql, batch)
+                batch = []
+        if batch:
+            self.connection.executemany(sql, batch)
+
+
+def _time_text(time) -> str:
+    if isinstance(time, datetime):
+        return time.strftime('%Y-%m-%d %H:%M:%S')
+    return time
+
+
+def _row_game(row: Tuple) -> Game:
+    start_time = datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S')
+    game = Game(match_id=row[0], stage=row[1], start_time=start_time,
+                teams=(row[3], row[4]), match_format=row[5])
+    if row[6] is None:
+        return game
+
+    return game._replace(game_id=row[6], game_number=row[7],
+                         map_name=row[8], score=(row[9], row[10]),
+                         rosters=(tuple(row[11:17]), tuple(row[17:23])))
@@ -0,0 +1,224 @@
+from collections import Counter, defaultdict, deque
+from itertools import combinations
+from typing import Dict, Hashable, Sequence, Set, Tuple
+
+MAX_MAP_DIFF = 4  # The winner of a regular match wins by 4 maps at most.
+MIN_MAP_DIFF = 1  # ... and by 1 map at least.
+
+Capacities = Dict[Hashable, Dict[Hashable, int]]
+
+
+def max_flow(capacities: Capacities, source: Hashable,
+             sink: Hashable) -> int:
+    """Return the value of a maximum flow from source to sink (Edmonds-Karp).
+    """
+    residual = defaultdict(dict)
+    for u, edges in capacities.items():
+        for v, capacity in edges.items():
+            residual[u][v] = residual[u].get(v, 0) + capacity
+            residual[v].setdefault(u, 0)
+
+    flow = 0
+    while True:
+        # Find the shortest augmenting path.
+        parents = {source: None}
+        queue = deque([source])
+
+        while queue and sink not in parents:
+            u = queue.popleft()
+            for v, capacity in residual[u].items():
+                if capacity > 0 and v not in parents:
+                    parents[v] = u
+                    queue.append(v)
+
+        if sink not in parents:
+            return flow
+
+        path = []
+        v = sink
+        while parents[v] is not None:
+            path.append((parents[v], v))
+            v = parents[v]
+
+        bottleneck = min(residual[u][v] for u, v in path)
+        for u, v in path:
+            residual[u][v] -= bottleneck
+            residual[v][u] += bottleneck
+
+        flow += bottleneck
+
+
+def decided_teams(wins: Sequence[int], map_diffs: Sequence[int],
+                  games: Sequence[Tuple[int, int]],
+                  places: int = 3) -> Tuple[Set[int], Set[int]]:
+    """Given the standings of teams and their remaining matches, return the
+    teams which have clinched and the teams which have been eliminated from
+    the top places.
+
+    Teams are ranked by wins, then map diffs. Whether the wins of all the
+    remaining matches can be split in some way is decided exactly with a
+    max-flow over the schedule. Map diffs are bounded team by team, and ties
+    are assumed to be broken in the way which keeps an outcome possible, so
+    a team is only reported when it is certain."""
+    teams = range(len(wins))
+    clinched = set(team for team in teams
+                   if _clinched(team, wins, map_diffs, games, places))
+    eliminated = set(team for team in teams
+                     if _eliminated(team, wins, map_diffs, games, places))
+
+    return clinched, eliminated
+
+
+def _eliminated(team: int, wins: Sequence[int], map_diffs: Sequence[int],
+                games: Sequence[Tuple[int, int]], places: int) -> bool:
+    """Return if the team cannot reach the top places even when it wins all
+    its remaining matches 4-0."""
+    remaining, vs_team = _remaining_games(team, games)
+    games = [game for game in games if team not in game]
+    best_wins = wins[team] + remaining[team]
+    best_map_diff = map_diffs[team] + MAX_MAP_DIFF * remaining[team]
+
+    # capacities[other]: most new wins other can take without finishing
+    # above the team.
+    capacities = {}
+    for other in range(len(wins)):
+        if other == team:
+            continue
+
+        n_games = remaining[other] - vs_team[other]
+        capacity = best_wins - wins[other]
+
+        if capacity <= n_games:
+            # Tied on wins, it needs to lose all other matches badly.
+            min_map_diff = (map_diffs[other] -
+                            MAX_MAP_DIFF * (vs_team[other] +
+                                            n_games - capacity) +
+                            MIN_MAP_DIFF * capacity)
+            if min_map_diff > best_map_diff:
+                capacity -= 1
+
+        capacities[other] = min(capacity, n_games)
+
+    # Only the teams with a binding capacity may be above the team.
+    threats = [other for other, capacity in capacities.items()
+               if capacity < remaining[other] - vs_team[other]]
+    above = [other for other in threats if capacities[other] < 0]
+
+    if len(threats) < places:
+        return False
+    if len(above) >= places:
+        return True
+
+    # Try letting every set of places - 1 threats finish above the team.
+    others = [other for other in threats if other not in above]
+    for extra in combinations(others, places - 1 - len(above)):
+        excluded = set(above).union(extra)
+        bounded = [other for other in threats if other not in excluded]
+
+        if _can_share_wins(bounded, games,
+                           {other: capacities[other] for other in bounded},
+                           must_assign=True):
+            return False
+
+    return True
+
+
+def _clinched(team: int, wins: Sequence[int], map_diffs: Sequence[int],
+              games: Sequence[Tuple[int, int]], places: int) -> bool:
+    """Return if the team stays in the top places even when it loses all its
+    remaining matches 0-4."""
+    remaining, vs_team = _remaining_games(team, games)
+    games = [game for game in games if team not in game]
+    worst_wins = wins[team]
+    worst_map_diff = map_diffs[team] - MAX_MAP_DIFF * remaining[team]
+
+    # needs[other]: fewest new wins other needs to finish above the team.
+    needs = {}
+    for other in range(len(wins)):
+        if other == team:
+            continue
+
+        n_games = remaining[other] - vs_team[other]
+        base_wins = wins[other] + vs_team[other]
+
+        if base_wins > worst_wins:
+            need = 0
+        else:
+            # Tied on wins, it needs to win all its matches 4-0.
+            need = worst_wins - base_wins
+            max_map_diff = (map_diffs[other] +
+                            MAX_MAP_DIFF * (vs_team[other] + need) -
+                            MIN_MAP_DIFF * (n_games - need))
+            if max_map_diff < worst_map_diff:
+                need += 1
+
+        if need <= n_games:
+            needs[other] = need
+
+    if len(needs) < places:
+        return True
+
+    # Try every set of teams which could finish above the team, the easiest
+    # first.
+    candidates = sorted(needs, key=lambda other: needs[other])
+    groups = sorted(combinations(candidates, places),
+                    key=lambda group: sum(needs[other] for other in group))
+
+    for group in groups:
+        if _can_share_wins(group, games,
+                           {other: needs[other] for other in group},
+                           must_assign=False):
+            return False
+
+    return True
+
+
+def _remaining_games(team: int, games: Sequence[Tuple[int, int]]):
+    remaining = Counter()
+    vs_team = Counter()
+
+    for team1, team2 in games:
+        remaining[team1] += 1
+        remaining[team2] += 1
+
+        if team1 == team:
+            vs_team[team2] += 1
+        elif team2 == team:
+            vs_team[team1] += 1
+
+    return remaining, vs_team
+
+
+def _can_share_wins(teams: Sequence[int], games: Sequence[Tuple[int, int]],
+                    wins: Dict[int, int], must_assign: bool) -> bool:
+    """Return if the wins of the remaining matches can be split so that
+    every team gets at most (must_assign=True, every match among the teams
+    has to be won by one of them) or at least (must_assign=False, any match
+    involving them may be won by them) its number of wins."""
+    teams = set(teams)
+    pairs = Counter()
+
+    for team1, team2 in games:
+        if must_assign:
+            involved = team1 in teams and team2 in teams
+        else:
+            involved = team1 in teams or team2 in teams
+
+        if involved:
+            pairs[(team1, team2)] += 1
+
+    capacities = defaultdict(dict)
+    for pair, n_games in pairs.items():
+        capacities['source'][pair] = n_games
+        for team in pair:
+            if team in teams:
+                capacities[pair][('team', team)] = n_games
+
+    for team in teams:
+        capacities[('team', team)]['sink'] = wins[team]
+
+    flow = max_flow(capacities, 'source', 'sink')
+    if must_assign:
+        return flow == sum(pairs.values())
+    else:
+        return flow == sum(wins.values())
@@ -1,22 +1,36 @@
+import asyncio
+import hashlib
+import json
+import os
+import sys
 from collections import defaultdict
+from contextlib import contextmanager
 from csv import (reader as csv_reader,
                  writer as csv_writer,
                  DictReader,
                  DictWriter)
 from datetime import datetime
-from typing import Dict, List, NamedTuple, Set, Tuple
+from typing import (Collection, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Sequence, Set, Tuple)
 
+from availability import Availabilities
+from cache import RawCache
+from client import APIClient
+from database import Database, DATABASE
 from game import Game
-
-import requests
+from store import GameStore, open_store
 
 GAMES_CSV = 'games.csv'
 AVAILABILITIES_CSV = 'availabilities.csv'
 RATINGS_CSV = 'ratings.csv'
+GAMES_STORE = 'games.bin'
+SYNC_JSON = 'sync.json'
+RAW_DIR = 'raw'
 BASE_URL = 'https://api.overwatchleague.com/'
+PAGE_SIZE = 100
 
-
-Availabilities = Dict[Tuple[str, int], Dict[str, Set[str]]]
+# Fields of a raw match parse_match depends on.
+MATCH_FIELDS = ('bracket', 'competitors', 'startDate', 'state', 'games')
 
 
 class CSVGame(NamedTuple):
@@ -47,22 +61,155 @@ class CSVGame(NamedTuple):
     team2_p6: str = None
 
 
-def fetch_games() -> List[CSVGame]:
-    url = BASE_URL + 'matches'
-    params = {'size': 1000}
-    result = requests.get(url, params).json()
+def fetch_games(base_url: str = BASE_URL, page_size: int = PAGE_SIZE,
+                client: APIClient = None) -> List[CSVGame]:
+    with _client(base_url, client) as client:
+        return asyncio.run(_fetch_games(client, page_size))
+
 
+async def _fetch_games(client: APIClient, page_size: int) -> List[CSVGame]:
     games = []
-    for raw_match in result['content']:
+    # Parse every page as soon as it arrives.
+    async for raw_match in client.fetch_pages(page_size):
         games += parse_match(raw_match)
-    games.sort(key=lambda game: game.start_time)
+    games.sort(key=lambda game: (game.start_time, game.match_id))
 
     return games
 
 
-def parse_match(raw_match) -> List[CSVGame]:
+def sync_games(csv_filename: str = GAMES_CSV,
+               state_filename: str = SYNC_JSON, base_url: str = BASE_URL,
+               page_size: int = PAGE_SIZE, match_ids: Iterable[int] = None,
+               raw_dir: Optional[str] = RAW_DIR, database: str = None,
+               client: APIClient = None) -> int:
+    """Update the games of a CSV file with the matches which changed since
+    the last sync, and return the number of those matches.
+    The validators of the pages and a digest of every match are kept in the
+    state file. Only the modified pages are downloaded, and only the matches
+    of which the digest changed are parsed again. If match_ids is given,
+    only those matches are requested, from their own endpoint.
+    Unless raw_dir is None, the raw matches are kept in a RawCache there,
+    see reparse_games. If database is given, the games are updated in that
+    Database instead."""
+    state = {'pages': {}, 'matches': {}}
+    if os.path.exists(state_filename) and \
+            os.path.exists(database or csv_filename):
+        with open(state_filename) as state_file:
+            state = json.load(state_file)
+
+    cache = None
+    if raw_dir is not None:
+        cache = RawCache(raw_dir)
+        listed = _listed_matches(state['pages'])
+        if listed is None or not all(match_id in cache
+                                     for match_id in listed):
+            # Download every page again, the cache misses some matches.
+            state['pages'] = {}
+
+    with _client(base_url, client) as client:
+        changed = asyncio.run(_sync_games(client, state, page_size,
+                                          match_ids, cache))
+
+    if changed:
+        merge_games(changed, csv_filename, database=database)
+    if cache is not None:
+        if match_ids is None:
+            # The matches of the pages not modified are still current.
+            cache.touch(_listed_matches(state['pages']))
+        cache.save()
+
+    # Written after the games, an interrupted sync is redone.
+    with open(state_filename + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(state_filename + '.tmp', state_filename)
+
+    return len(changed)
+
+
+async def _sync_games(client: APIClient, state: Dict, page_size: int,
+                      match_ids: Optional[Iterable[int]],
+                      cache: Optional[RawCache]
+                      ) -> Dict[int, List[CSVGame]]:
+    changed = {}
+
+    def update(raw_match: Dict) -> None:
+        if cache is not None:
+            cache.put(raw_match['id'], raw_match)
+
+        digest = match_digest(raw_match)
+        if state['matches'].get(str(raw_match['id'])) != digest:
+            changed[raw_match['id']] = list(parse_match(raw_match))
+            state['matches'][str(raw_match['id'])] = digest
+
+    if match_ids is not None:
+        async for raw_match in client.fetch_matches(match_ids):
+            update(raw_match)
+    else:
+        async for raw_match in client.fetch_pages(page_size,
+                                                  state['pages']):
+            update(raw_match)
+
+    return changed
+
+
+def reparse_games(csv_filename: str = GAMES_CSV, raw_dir: str = RAW_DIR,
+                  state_filename: str = SYNC_JSON,
+                  database: str = None) -> int:
+    """Rebuild the games of a CSV file, or of a Database, from the raw
+    matches kept by sync_games, without requesting the API. Return the
+    number of matches.
+    Raise ValueError if the cache misses some matches of the last sync,
+    rather than dropping their games."""
+    cache = RawCache(raw_dir)
+
+    if os.path.exists(state_filename):
+        with open(state_filename) as state_file:
+            synced = json.load(state_file)['matches']
+        missing = [match_id for match_id in synced if match_id not in cache]
+        if missing:
+            raise ValueError(f'{len(missing)} synced matches are not in '
+                             f'{raw_dir}, sync the games again.')
+
+    games = []
+    for _, raw_match in cache.items():
+        games += parse_match(raw_match)
+    games.sort(key=lambda game: (game.start_time, game.match_id))
+
+    save_games(games, csv_filename, database=database)
+    return len(cache)
+
+
+def _listed_matches(pages: Dict[str, Dict]) -> Optional[Set[int]]:
+    """Return the ids of the matches of the pages, None if unknown."""
+    listed = set()
+    for validators in pages.values():
+        if 'match_ids' not in validators:
+            return None
+        listed.update(validators['match_ids'])
+    return listed
+
+
+@contextmanager
+def _client(base_url: str, client: Optional[APIClient]
+            ) -> Iterator[APIClient]:
+    """Use the given client, or a new one closed on exit."""
+    if client is not None:
+        yield client
+    else:
+        with APIClient(base_url) as client:
+            yield client
+
+
+def match_digest(raw_match: Dict) -> str:
+    """Return a digest of the fields of a raw match which are parsed."""
+    fields = {field: raw_match.get(field) for field in MATCH_FIELDS}
+    text = json.dumps(fields, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def parse_match(raw_match) -> Iterator[CSVGame]:
     if None in raw_match['competitors']:
-        return []  # The competitors have not been decided, don't parse it.
+        return  # The competitors have not been decided, don't parse it.
 
     match_id = raw_match['id']
     stage = raw_match['bracket']['stage']['title']
@@ -86,21 +233,17 @@ def parse_match(raw_match) -> List[CSVGame]:
                         match_format=match_format)
 
     if raw_match['state'] != 'CONCLUDED':
-        return [base_game]  # This a unfinished match.
+        yield base_game  # This a unfinished match.
+        return
 
-    games = []
     for raw_game in raw_match['games']:
-        game = parse_game(raw_game, base_game, team1_id, team2_id)
-        if game is not None:
-            games.append(game)
-
-    return games
+        yield from parse_game(raw_game, base_game, team1_id, team2_id)
 
 
 def parse_game(raw_game, base_game: CSVGame, team1_id: int,
-               team2_id: int) -> CSVGame:
+               team2_id: int) -> Iterator[CSVGame]:
     if raw_game['state'] != 'CONCLUDED':
-        return None  # This is an unfinished match, don't parse it.
+        return  # This is an unfinished match, don't parse it.
 
     game_id = raw_game['id']
     game_number = raw_game['number']
@@ -129,67 +272,189 @@ def parse_game(raw_game, base_game: CSVGame, team1_id: int,
 
     if n_team1 != 6 or n_team2 != 6:
         print(f'{game_id}: Invalid player numbers, skipping.')
-        return None
+        return
 
-    game = base_game._replace(game_id=game_id, game_number=game_number,
-                              map_name=map_name,
-                              score1=score[0], score2=score[1], **names)
-    return game
+    yield base_game._replace(game_id=game_id, game_number=game_number,
+                             map_name=map_name,
+                             score1=score[0], score2=score[1], **names)
 
 
-def save_games(games: List[CSVGame], csv_filename: str = GAMES_CSV) -> None:
-    with open(csv_filename, 'w', newline='') as csv_file:
+def save_games(games: Iterable[CSVGame], csv_filename: str = GAMES_CSV,
+               database: str = None) -> None:
+    if database is not None:
+        with Database(database) as db:
+            db.save_games(games)
+        return
+
+    # Write to a temporary file first, readers never see a partial file.
+    with open(csv_filename + '.tmp', 'w', newline='') as csv_file:
         writer = csv_writer(csv_file)
         writer.writerow(CSVGame._fields)  # Write headers.
         writer.writerows(games)
+    os.replace(csv_filename + '.tmp', csv_filename)
+
+
+def merge_games(changed: Dict[int, List[CSVGame]],
+                csv_filename: str = GAMES_CSV, database: str = None) -> None:
+    """Replace the games of the changed matches in a CSV file, or in a
+    Database, keeping the other rows as they are."""
+    if database is not None:
+        with Database(database) as db:
+            db.upsert_games(changed)
+        return
+
+    rows = []
+    if os.path.exists(csv_filename):
+        with open(csv_filename, newline='') as csv_file:
+            reader = csv_reader(csv_file)
+            next(reader, None)  # Skip the header line.
+            rows = list(reader)
+
+    # The games of a match take the place of its previous games.
+    merged = []
+    merged_ids = set()
+    for row in rows:
+        match_id = int(row[0])
+        if match_id not in changed:
+            merged.append(row)
+        elif match_id not in merged_ids:
+            merged += changed[match_id]
+            merged_ids.add(match_id)
+    for match_id, games in changed.items():
+        if match_id not in merged_ids:
+            merged += games
+
+    # Sort by start time & match id, like fetch_games.
+    merged.sort(key=lambda row: (str(row[2]), int(row[0])))
+    save_games(merged, csv_filename)
+
+
+def load_games(csv_filename: str = GAMES_CSV,
+               store_filename: Optional[str] = GAMES_STORE,
+               database: str = None
+               ) -> Tuple[Sequence[Game], Sequence[Game]]:
+    """Load past & future games from a csv file, or from a Database.
+    Unless store_filename is None, the games of the csv file are read from a
+    GameStore there, built again when the file changed, and are only built
+    when accessed. When the GameStore can't be written, as in a read-only
+    checkout, the csv file is read instead."""
+    if database is not None:
+        with Database(database) as db:
+            return db.load_games()
+    store = _open_store(csv_filename, store_filename)
+    if store is not None:
+        return store.games(played=True), store.games(played=False)
 
-
-def load_games(csv_filename: str = GAMES_CSV) -> Tuple[List[Game], List[Game]]:
-    """Load past & future games from a csv file."""
     past_games = []
     future_games = []
 
+    for game in iter_games(csv_filename, store_filename=None):
+        if game.game_id is not None:
+            past_games.append(game)
+        else:
+            future_games.append(game)
+
+    return past_games, future_games
+
+
+def iter_games(csv_filename: str = GAMES_CSV,
+               store_filename: Optional[str] = GAMES_STORE,
+               stage: str = None, start: datetime = None,
+               end: datetime = None, match_ids: Collection[int] = None,
+               played: bool = None, database: str = None) -> Iterator[Game]:
+    """Yield the games of a csv file, in order, which are of the given stage,
+    start between start (included) and end (excluded), are of the given
+    matches, and have been played or not. Filters left to None are not
+    applied. Games are filtered before they are built: on the columns of
+    the GameStore (see load_games), on the fields of csv rows, or in the
+    query of a Database."""
+    if database is not None:
+        with Database(database) as db:
+            yield from db.iter_games(stage=stage, start=start, end=end,
+                                     match_ids=match_ids, played=played)
+        return
+    store = _open_store(csv_filename, store_filename)
+    if store is not None:
+        indices = store.select(stage=stage, start=start, end=end,
+                               match_ids=match_ids, played=played)
+        for index in indices:
+            yield store.game(index)
+        return
+
+    # The csv format of times sorts like times.
+    if start is not None:
+        start = start.strftime('%Y-%m-%d %H:%M:%S')
+    if end is not None:
+        end = end.strftime('%Y-%m-%d %H:%M:%S')
+
     with open(csv_filename, newline='') as csv_file:
         reader = csv_reader(csv_file)
         next(reader, None)  # Skip the header line.
 
         for csv_game in map(CSVGame._make, reader):
-            match_id = int(csv_game.match_id)
-            stage = csv_game.stage
-            start_time = datetime.strptime(csv_game.start_time,
-                                           '%Y-%m-%d %H:%M:%S')
-            teams = (csv_game.team1, csv_game.team2)
-            match_format = csv_game.match_format
-
-            if csv_game.game_id:
-                game_id = int(csv_game.game_id)
-                game_number = int(csv_game.game_number)
-                map_name = csv_game.map_name
-                score = (int(csv_game.score1), int(csv_game.score2))
-                rosters = (
-                    (csv_game.team1_p1, csv_game.team1_p2, csv_game.team1_p3,
-                     csv_game.team1_p4, csv_game.team1_p5, csv_game.team1_p6),
-                    (csv_game.team2_p1, csv_game.team2_p2, csv_game.team2_p3,
-                     csv_game.team2_p4, csv_game.team2_p5, csv_game.team2_p6)
-                )
-
-                game = Game(match_id=match_id, stage=stage,
-                            start_time=start_time, teams=teams,
-                            match_format=match_format, game_id=game_id,
-                            game_number=game_number, map_name=map_name,
-                            score=score, rosters=rosters)
-                past_games.append(game)
-            else:
-                game = Game(match_id=match_id, stage=stage,
-                            start_time=start_time, teams=teams,
-                            match_format=match_format)
-                future_games.append(game)
+            if played is not None and bool(csv_game.game_id) != played:
+                continue
+            if stage is not None and csv_game.stage != stage:
+                continue
+            if start is not None and csv_game.start_time < start:
+                continue
+            if end is not None and csv_game.start_time >= end:
+                continue
+            if match_ids is not None and \
+                    int(csv_game.match_id) not in match_ids:
+                continue
+
+            yield _csv_game(csv_game)
+
+
+def _open_store(csv_filename: str, store_filename: Optional[str]
+                ) -> Optional[GameStore]:
+    """Return the GameStore of a csv file, or None if store_filename is None
+    or the store can't be built there."""
+    if store_filename is None:
+        return None
+    try:
+        return open_store(csv_filename, store_filename)
+    except OSError:
+        return None
 
-    return past_games, future_games
 
+def _csv_game(csv_game: CSVGame) -> Game:
+    """Build a game from a row of a csv file."""
+    match_id = int(csv_game.match_id)
+    stage = csv_game.stage
+    start_time = datetime.strptime(csv_game.start_time, '%Y-%m-%d %H:%M:%S')
+    teams = (csv_game.team1, csv_game.team2)
+    match_format = csv_game.match_format
+
+    if not csv_game.game_id:
+        return Game(match_id=match_id, stage=stage, start_time=start_time,
+                    teams=teams, match_format=match_format)
+
+    game_id = int(csv_game.game_id)
+    game_number = int(csv_game.game_number)
+    map_name = csv_game.map_name
+    score = (int(csv_game.score1), int(csv_game.score2))
+    rosters = (
+        (csv_game.team1_p1, csv_game.team1_p2, csv_game.team1_p3,
+         csv_game.team1_p4, csv_game.team1_p5, csv_game.team1_p6),
+        (csv_game.team2_p1, csv_game.team2_p2, csv_game.team2_p3,
+         csv_game.team2_p4, csv_game.team2_p5, csv_game.team2_p6)
+    )
+
+    return Game(match_id=match_id, stage=stage, start_time=start_time,
+                teams=teams, match_format=match_format, game_id=game_id,
+                game_number=game_number, map_name=map_name, score=score,
+                rosters=rosters)
+
+
+def load_availabilities(csv_filename: str = AVAILABILITIES_CSV,
+                        database: str = None) -> Availabilities:
+    """Load the availabilities of players, indexed."""
+    if database is not None:
+        with Database(database) as db:
+            return Availabilities(db.load_availabilities())
 
-def load_availabilities(
-        csv_filename: str = AVAILABILITIES_CSV) -> Availabilities:
     availabilities = {}
 
     with open(csv_filename, newline='') as csv_file:
@@ -205,10 +470,16 @@ def load_availabilities(
 
             availabilities[(stage, match_number)] = team_members
 
-    return availabilities
+    return Availabilities(availabilities)
+
 
+def save_ratings_history(history, mu, sigma, csv_filename: str = RATINGS_CSV,
+                         database: str = None):
+    if database is not None:
+        with Database(database) as db:
+            db.save_ratings_history(history)
+        return
 
-def save_ratings_history(history, mu, sigma, csv_filename: str = RATINGS_CSV):
     # Collect all unique names.
     names = set(name for ratings in history.values()
                 for name in ratings.keys())
@@ -234,6 +505,25 @@ def save_ratings_history(history, mu, sigma, csv_filename: str = RATINGS_CSV):
             writer.writerow(row)
 
 
+def export_database(database: str = DATABASE,
+                    csv_filename: str = GAMES_CSV,
+                    availabilities_filename: str = AVAILABILITIES_CSV
+                    ) -> None:
+    """Copy the games & availabilities of the csv files into a Database."""
+    with open(csv_filename, newline='') as csv_file:
+        reader = csv_reader(csv_file)
+        next(reader, None)  # Skip the header line.
+
+        with Database(database) as db:
+            db.save_games(reader)
+            db.save_availabilities(
+                load_availabilities(availabilities_filename))
+
+
 if __name__ == '__main__':
-    games = fetch_games()
-    save_games(games)
+    if sys.argv[1:] == ['reparse']:
+        reparse_games()
+    elif sys.argv[1:] == ['database']:
+        export_database()
+    else:
+        sync_games()
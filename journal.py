@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+from typing import Dict, Sequence, Tuple
+
+from trueskill import Rating
+
+from game import Game
+from observers import MatchPrediction, Observer
+
+JOURNAL_FILENAME = 'journal.jsonl'
+
+
+def config_hash(config: Dict) -> str:
+    """Return a short hash identifying the configuration of a predictor."""
+    text = json.dumps(config, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def chain_digest(digest: str, game: Game) -> str:
+    """Return the digest of the games up to a game, given the digest of the
+    games before it."""
+    return hashlib.sha1((digest + repr(game)).encode()).hexdigest()
+
+
+class PredictionJournal(Observer):
+    """Append the prediction of every game and every match, made before it is
+    played, to a journal file with one JSON record per line. Records are
+    keyed by game_id or match_id and the hash of the predictor config, and
+    hold the digest of the games trained on up to theirs, see
+    chain_digest."""
+
+    def __init__(self, config: Dict,
+                 filename: str = JOURNAL_FILENAME) -> None:
+        super().__init__()
+
+        self.config = config_hash(config)
+        self.filename = filename
+        self.games = ''
+        self._file = None
+        self._match_id = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    def __enter__(self) -> 'PredictionJournal':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def before_game(self, predictor, game: Game) -> None:
+        self.games = chain_digest(self.games, game)
+        if game.match_id != self._match_id:
+            self._match_id = game.match_id
+            self._write(self._match_record(predictor, game))
+
+        self._write(self._game_record(predictor, game))
+
+    def after_game(self, predictor, game: Game) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _match_record(self, predictor, game: Game) -> Dict:
+        # Predict in the format of the match cards and MatchPredictions,
+        # so journaled cards render the same as live ones.
+        p_scores = predictor.predict_match_score(game.teams)
+        p_win, e_diff = predictor.predict_match(game.teams)
+
+        record = {
+            'config': self.config,
+            'games': self.games,
+            'match_id': game.match_id,
+            'teams': list(game.teams),
+            'p_win': p_win,
+            'e_diff': e_diff,
+            'p_scores': [[score1, score2, p]
+                         for (score1, score2), p in p_scores.items()]
+        }
+
+        ratings = getattr(predictor, 'ratings', None)
+        if ratings is not None:
+            record['ratings'] = [[ratings[team].mu, ratings[team].sigma]
+                                 for team in game.teams]
+
+        return record
+
+    def _game_record(self, predictor, game: Game) -> Dict:
+        p_undrawable, p_drawable = predictor.predict_game(game)
+        p_win, p_draw = p_drawable if game.drawable else p_undrawable
+        point, correct = predictor.evaluate(game)
+
+        return {
+            'config': self.config,
+            'games': self.games,
+            'match_id': game.match_id,
+            'game_id': game.game_id,
+            'p_win': p_win,
+            'p_draw': p_draw,
+            'point': point,
+            'correct': correct
+        }
+
+    def _write(self, record: Dict) -> None:
+        if self._file is None:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.filename, 'a')
+
+        print(json.dumps(record, separators=(',', ':')), file=self._file)
+
+
+def read_journal(config: Dict, filename: str = JOURNAL_FILENAME
+                 ) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+    """Return the match records by match_id and the game records by game_id
+    of the given predictor config. Later records replace earlier ones."""
+    config = config_hash(config)
+    matches = {}
+    games = {}
+
+    if not os.path.exists(filename):
+        return matches, games
+
+    with open(filename) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A partially written last line.
+                continue
+
+            if record['config'] != config:
+                continue
+            if 'game_id' in record:
+                games[record['game_id']] = record
+            else:
+                matches[record['match_id']] = record
+
+    return matches, games
+
+
+def journal_match_predictions(config: Dict, filename: str = JOURNAL_FILENAME
+                              ) -> Dict[int, MatchPrediction]:
+    """Return the journaled predictions of matches in the format of the
+    MatchPredictions observer."""
+    matches, _ = read_journal(config, filename)
+    return {match_id: MatchPrediction(
+                p_win=record['p_win'], e_diff=record['e_diff'],
+                ratings=tuple(Rating(mu=mu, sigma=sigma)
+                              for mu, sigma in record.get('ratings', [])))
+            for match_id, record in matches.items()}
+
+
+def journal_evaluation(config: Dict, games: Sequence[Game],
+                       filename: str = JOURNAL_FILENAME
+                       ) -> Tuple[float, float]:
+    """Return the average prediction point & accuracy of the given games,
+    trained on in order from the first one, from the journal. Raise KeyError
+    if a game is not journaled after the same games."""
+    _, journaled = read_journal(config, filename)
+    records = []
+    digest = ''
+    for game in games:
+        digest = chain_digest(digest, game)
+        record = journaled[game.game_id]
+        if record.get('games') != digest:
+            raise KeyError(game.game_id)
+        records.append(record)
+
+    avg_point = sum(record['point'] for record in records) / len(records)
+    avg_accuracy = (sum(record['correct'] for record in records) /
+                    len(records))
+    return avg_point, avg_accuracy
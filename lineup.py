@@ -0,0 +1,119 @@
+import itertools
+from functools import lru_cache
+from math import comb
+from typing import Callable, Tuple
+
+import numpy as np
+
+# Lineups scored in one batch at most, exhaustive searches up to 20 players.
+MAX_BATCH = 40000
+
+# score(sums of mu, sums of variances) => scores of lineups
+Score = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def min_rating(sum_mu: np.ndarray, sum_var: np.ndarray,
+               size: int = 6) -> np.ndarray:
+    """Score lineups by the min rating of their team rating, see
+    PlayerTrueSkillPredictor._roster_rating."""
+    return (sum_mu - 3.0 * np.sqrt(sum_var)) / size
+
+
+def best_lineup(mu: np.ndarray, sigma: np.ndarray, size: int = 6,
+                score: Score = min_rating,
+                max_batch: int = MAX_BATCH) -> Tuple[np.ndarray, float]:
+    """Return the indices of the lineup of size players with the best score
+    and that score. score must not decrease with the sum of mu, and be
+    monotonic in the sum of variances for a given sum of mu.
+    Every lineup is scored at once when there are at most max_batch of
+    them. Otherwise, lineups are searched by branch and bound on their two
+    best players by mu."""
+    n = len(mu)
+    if n <= size:
+        indices = np.arange(n)
+        return indices, float(score(mu.sum(), np.square(sigma).sum()))
+
+    # Sort the players by mu, so the best completions of a lineup are the
+    # next players.
+    order = np.argsort(-mu, kind='stable')
+    mu = mu[order]
+    var = np.square(sigma[order])
+
+    if size <= 2 or comb(n, size) <= max_batch:
+        lineup, best = _search(mu, var, np.arange(n), size, score,
+                               max_batch)
+        return order[lineup], best
+
+    # Start from the best lineup of the best players.
+    lineup, best = _search(mu, var, np.arange(min(n, 2 * size)), size,
+                           score, max_batch)
+
+    # Bound the lineups of every pair of first players.
+    rest = size - 2
+    pairs, _ = _lineups(n - rest, 2)
+    firsts, seconds = pairs[:, 0], pairs[:, 1]
+    cum_mu = np.concatenate([[0.0], np.cumsum(mu)])
+    min_var = np.minimum.accumulate(var[::-1])[::-1]
+    max_var = np.maximum.accumulate(var[::-1])[::-1]
+
+    pair_mu = (mu[firsts] + mu[seconds] +
+               cum_mu[seconds + 1 + rest] - cum_mu[seconds + 1])
+    pair_var = var[firsts] + var[seconds]
+    bounds = np.maximum(
+        score(pair_mu, pair_var + rest * min_var[seconds + 1]),
+        score(pair_mu, pair_var + rest * max_var[seconds + 1]))
+
+    for i in np.argsort(-bounds, kind='stable').tolist():
+        if bounds[i] <= best:
+            break
+
+        first, second = pairs[i].tolist()
+        candidates = np.arange(second + 1, n)
+        rest_lineup, rest_best = _search(
+            mu, var, candidates, rest, score, max_batch,
+            prefix_mu=mu[first] + mu[second], prefix_var=pair_var[i])
+        if rest_best > best:
+            lineup = np.concatenate([[first, second], rest_lineup])
+            best = rest_best
+
+    return order[lineup], best
+
+
+def _search(mu: np.ndarray, var: np.ndarray, candidates: np.ndarray,
+            size: int, score: Score, max_batch: int,
+            prefix_mu: float = 0.0, prefix_var: float = 0.0
+            ) -> Tuple[np.ndarray, float]:
+    """Score every lineup of size candidates, along with a prefix, in
+    batches. Return the first best one and its score."""
+    combinations, indicators = _lineups(len(candidates), size)
+    # Sum the mu & variances of all the lineups by a single product.
+    candidate_mu_var = np.stack([mu[candidates], var[candidates]], axis=1)
+    lineup = None
+    best = -np.inf
+
+    for start in range(0, len(combinations), max_batch):
+        sum_mu, sum_var = (indicators[start:start + max_batch] @
+                           candidate_mu_var).T
+        scores = score(prefix_mu + sum_mu, prefix_var + sum_var)
+        i = int(np.argmax(scores))
+        if scores[i] > best:
+            lineup = candidates[combinations[start + i]]
+            best = float(scores[i])
+
+    return lineup, best
+
+
+@lru_cache(maxsize=32)
+def _lineups(n: int, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the (lineups, size) array of the combinations of size indices
+    of n in lexicographic order, and their (lineups, n) indicator matrix."""
+    combinations = np.fromiter(
+        (i for combination in itertools.combinations(range(n), size)
+         for i in combination),
+        dtype=np.intp, count=comb(n, size) * size).reshape(-1, size)
+    indicators = np.zeros((len(combinations), n))
+    np.put_along_axis(indicators, combinations, 1.0, axis=1)
+
+    combinations.flags.writeable = False
+    indicators.flags.writeable = False
+    return combinations, indicators
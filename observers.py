@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from typing import NamedTuple, Tuple
+
+from game import Game
+
+
+class Observer(object):
+    """Base class for observers of the games a predictor is trained on."""
+
+    def before_game(self, predictor, game: Game) -> None:
+        """Called before the predictor is trained on the game."""
+        pass
+
+    def after_game(self, predictor, game: Game) -> None:
+        """Called after the predictor is trained on the game."""
+        pass
+
+
+class Evaluation(Observer):
+    """Record the prediction point of every game, see Predictor.evaluate."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.points = []
+        self.corrects = []
+
+    def before_game(self, predictor, game: Game) -> None:
+        point, correct = predictor.evaluate(game)
+        self.points.append(point)
+        self.corrects.append(correct)
+
+
+class DrawCounter(Observer):
+    """Count expected & real draws, used to adjust parameters related to
+    draws."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.expected_draws = 0.0
+        self.real_draws = 0.0
+
+    def before_game(self, predictor, game: Game) -> None:
+        if game.drawable:
+            _, (_, p_draw) = predictor.predict_game(game)
+            self.expected_draws += p_draw
+        if game.score[0] == game.score[1]:
+            self.real_draws += 1.0
+
+
+class RatingsHistory(Observer):
+    """Record the ratings of the available players and the teams after
+    every match of every team."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # (stage, match number) => {player or team: rating}
+        self.history = OrderedDict()
+
+    def after_game(self, predictor, game: Game) -> None:
+        for team in game.teams:
+            match_number = len(predictor.match_history[predictor.stage][team])
+            match_key = (predictor.stage, match_number)
+
+            if match_key not in self.history:
+                self.history[match_key] = {}
+            ratings = self.history[match_key]
+
+            for name in predictor.availabilities[match_key][team]:
+                ratings[name] = predictor.ratings[name]
+            ratings[team] = predictor.ratings[team]
+
+
+class MatchPrediction(NamedTuple):
+    """Prediction of a match made before its first game."""
+    p_win: float
+    e_diff: float
+    ratings: Tuple
+
+
+class MatchPredictions(Observer):
+    """Record the prediction of every match and the ratings of its teams
+    before its first game."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.predictions = {}
+
+    def before_game(self, predictor, game: Game) -> None:
+        if game.match_id in self.predictions:
+            return
+
+        p_win, e_diff = predictor.predict_match(game.teams)
+        ratings = tuple(predictor.ratings[team] for team in game.teams)
+        self.predictions[game.match_id] = MatchPrediction(
+            p_win=p_win, e_diff=e_diff, ratings=ratings)
@@ -1,73 +1,163 @@
-from collections import defaultdict, deque, OrderedDict
-from functools import cmp_to_key
-from itertools import chain
+from collections import defaultdict, deque
+from functools import lru_cache, partial
 from math import log, sqrt
-from random import choices, random
-from typing import Dict, List, Sequence, Set, Tuple
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import gzip
+import hashlib
+import json
+import os
+import pickle
 
 import numpy as np
 from scipy.optimize import fmin
+from scipy.special import ndtr, ndtri
 from trueskill import calc_draw_margin, Rating, TrueSkill
 
+from availability import Availabilities
+from cache import LRUCache
 from game import Roster, Game
-from fetcher import (Availabilities,
+from elimination import decided_teams
+from fetcher import (iter_games,
                      load_availabilities,
                      load_games,
                      save_ratings_history)
+from journal import config_hash, journal_evaluation, PredictionJournal
+from lineup import best_lineup, min_rating
+from observers import DrawCounter, Evaluation, Observer, RatingsHistory
+from ratings import RatingStore
+from simulator import (EXACT_STATES, normal_intervals, StageScenarios,
+                       StageSimulator, wilson_intervals)
+from standings import Standings, TeamIds
 
 
 PScores = Dict[Tuple[int, int], float]
+# Win/draw probabilities on undrawable maps, then on drawable maps.
+PBoth = Tuple[Tuple[float, float], Tuple[float, float]]
+
+CHECKPOINT_VERSION = 4
+CHECKPOINT_DIR = 'checkpoints'
+
+# Whether each game of a match may end in a draw, by match format.
+MATCH_DRAWABLES = {
+    'regular': (True, False, True, False),
+    'title': (False, False, True, True, False)
+}
+
+
+class StagePrediction(NamedTuple):
+    """Top 3 & top 1 probabilities of every team in a stage, their
+    confidence intervals and the number of simulated iterations."""
+    probabilities: Dict[str, Tuple[float, float]]
+    intervals: Dict[str, Tuple[Tuple[float, float], Tuple[float, float]]]
+    iters: int
 
 
 class Predictor(object):
     """Base class for all OWL predictors."""
 
     def __init__(self, availabilities: Availabilities = None,
-                 roster_queue_size: int = 12) -> None:
+                 roster_queue_size: int = 12,
+                 match_cache_size: int = 4096,
+                 observers: Sequence[Observer] = None) -> None:
         super().__init__()
 
         # Players availabilities.
         if availabilities is None:
             availabilities = load_availabilities()
+        elif not isinstance(availabilities, Availabilities):
+            availabilities = Availabilities(availabilities)
         self.availabilities = availabilities
 
         # Track recent used rosters.
         self.roster_queues = defaultdict(
-            lambda: deque(maxlen=roster_queue_size))
+            partial(deque, maxlen=roster_queue_size))
 
-        # Global standings.
-        self.map_diffs = defaultdict(int)
-        self.head_to_head_map_diffs = defaultdict(int)
+        # Global standings, teams are interned to the ids of their arrays.
+        self.team_ids = TeamIds()
+        self.standings = Standings(self.team_ids, vectors=['map_diffs'],
+                                   matrices=['head_to_head_map_diffs'])
+        self.map_diffs = self.standings.view('map_diffs')
+        self.head_to_head_map_diffs = self.standings.pair_view(
+            'head_to_head_map_diffs')
 
         # Stage standings.
         self.stage = None
         self.base_stage = None
 
-        self.stage_wins = defaultdict(int)
-        self.stage_losses = defaultdict(int)
-        self.stage_map_diffs = defaultdict(int)
-        self.stage_head_to_head_map_diffs = defaultdict(int)
-        self.stage_title_wins = defaultdict(int)
-        self.stage_title_losses = defaultdict(int)
+        self.stage_standings = Standings(
+            self.team_ids,
+            vectors=['wins', 'losses', 'map_diffs', 'title_wins',
+                     'title_losses'],
+            matrices=['head_to_head_map_diffs'])
+        self.stage_wins = self.stage_standings.view('wins')
+        self.stage_losses = self.stage_standings.view('losses')
+        self.stage_map_diffs = self.stage_standings.view('map_diffs')
+        self.stage_head_to_head_map_diffs = self.stage_standings.pair_view(
+            'head_to_head_map_diffs')
+        self.stage_title_wins = self.stage_standings.view('title_wins')
+        self.stage_title_losses = self.stage_standings.view('title_losses')
 
         # Match standings.
         self.match_id = None
         self.score = None
         self.scores = defaultdict(dict)
         # stage => {team: [match_id]}
-        self.match_history = defaultdict(lambda: defaultdict(list))
+        self.match_history = defaultdict(partial(defaultdict, list))
+
+        # Observers of the trained games, they record anything beyond the
+        # model itself.
+        if observers is None:
+            observers = self.default_observers()
+        self.observers = list(observers)
+        self.n_trained_games = 0
+
+        # Match predictions are memoized until the next training.
+        self.rating_version = 0
+        self.match_cache = LRUCache(maxsize=match_cache_size)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        # Availabilities are reloaded and match predictions recomputed.
+        del state['availabilities']
+        state['match_cache'] = LRUCache(maxsize=self.match_cache.maxsize)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.availabilities = None
+
+    @staticmethod
+    def default_observers() -> List[Observer]:
+        return [Evaluation(), DrawCounter()]
+
+    def observer(self, class_):
+        """Return the observer of the given class."""
+        for observer in self.observers:
+            if isinstance(observer, class_):
+                return observer
+        raise AttributeError(f'{class_.__name__} is not observed')
+
+    @property
+    def points(self) -> List[float]:
+        return self.observer(Evaluation).points
+
+    @property
+    def corrects(self) -> List[bool]:
+        return self.observer(Evaluation).corrects
 
-        # Draw counts, used to adjust parameters related to draws.
-        self.expected_draws = 0.0
-        self.real_draws = 0.0
+    @property
+    def expected_draws(self) -> float:
+        return self.observer(DrawCounter).expected_draws
 
-        # Evaluation history, used to judge the performance of a predictor.
-        self.points = []
-        self.corrects = []
+    @property
+    def real_draws(self) -> float:
+        return self.observer(DrawCounter).real_draws
 
     @property
     def stage_finished(self):
-        return sum(self.stage_title_losses.values()) == 2
+        return bool(self.stage_standings.snapshot()['title_losses'].sum() == 2)
 
     def _train(self, game: Game) -> None:
         """Given a game result, train the underlying model."""
@@ -79,20 +169,42 @@ class Predictor(object):
         """Given two teams, return win/draw probabilities of them."""
         raise NotImplementedError
 
-    def train(self, game: Game) -> float:
-        """Given a game result, train the underlying model.
-        Return the prediction point for this game before training."""
-        point, correct = self.evaluate(game)
-        self.points.append(point)
-        self.corrects.append(correct)
+    def predict_both(self, teams: Tuple[str, str],
+                     rosters: Tuple[Roster, Roster] = None) -> PBoth:
+        """Given two teams, return win/draw probabilities of them on
+        undrawable and drawable maps."""
+        return (self.predict(teams, rosters, drawable=False),
+                self.predict(teams, rosters, drawable=True))
+
+    def predict_game(self, game: Game) -> PBoth:
+        """Return predict_both of a game, memoized until the next training
+        since the observers all predict the game about to be trained."""
+        key = ('game', self.rating_version, tuple(game.teams),
+               _rosters_key(game.rosters))
+        return self.match_cache.get(
+            key, lambda: self.predict_both(game.teams, game.rosters))
+
+    def train(self, game: Game) -> Optional[float]:
+        """Given a game result, train the underlying model and notify the
+        observers. Return the prediction point for this game before training
+        if it is evaluated."""
+        for observer in self.observers:
+            observer.before_game(self, game)
 
         self._update_rosters(game)
         self._update_standings(game)
-        self._update_draws(game)
 
         self._train(game)
+        self.rating_version += 1
+        self.n_trained_games += 1
+
+        for observer in self.observers:
+            observer.after_game(self, game)
 
-        return point
+        if any(isinstance(observer, Evaluation)
+               for observer in self.observers):
+            return self.points[-1]
+        return None
 
     def evaluate(self, game: Game) -> Tuple[float, bool]:
         """Return the prediction point for this game.
@@ -100,7 +212,7 @@ class Predictor(object):
         if game.score[0] == game.score[1]:
             return 0.0, False
 
-        p_win, p_draw = self.predict(game.teams, game.rosters, drawable=False)
+        (p_win, p_draw), _ = self.predict_game(game)
         p_win = max(0.0, min(p_win, 1.0))
         p_draw = max(0.0, min(p_draw, 1.0))
         p_loss = 1.0 - p_win - p_draw
@@ -114,14 +226,53 @@ class Predictor(object):
 
         return log(2.0 * p), correct
 
+    def save_checkpoint(self, filename: str, config: Dict = None) -> None:
+        """Save the state of the predictor, along with the parameters it was
+        created with."""
+        checkpoint = {
+            'version': CHECKPOINT_VERSION,
+            'class': type(self).__name__,
+            'config': config,
+            'predictor': self
+        }
+
+        # Write to a temporary file first, a checkpoint is never partial.
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with gzip.open(filename + '.tmp', 'wb') as file:
+            pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.tmp', filename)
+
+    @staticmethod
+    def load_checkpoint(filename: str,
+                        availabilities: Availabilities = None
+                        ) -> Tuple['Predictor', Dict]:
+        """Load a predictor and its parameters saved by save_checkpoint."""
+        with gzip.open(filename, 'rb') as file:
+            checkpoint = pickle.load(file)
+
+        if checkpoint['version'] != CHECKPOINT_VERSION:
+            raise ValueError(f'Unsupported checkpoint version '
+                             f'{checkpoint["version"]}')
+
+        predictor = checkpoint['predictor']
+        if availabilities is None:
+            availabilities = load_availabilities()
+        elif not isinstance(availabilities, Availabilities):
+            availabilities = Availabilities(availabilities)
+        predictor.availabilities = availabilities
+
+        return predictor, checkpoint['config']
+
     def train_games(self, games: Sequence[Game]) -> float:
         """Given a sequence of games, train the underlying model.
-        Return the prediction point for all the games."""
+        Return the prediction point for all the games, 0 if they are not
+        evaluated."""
         total_point = 0.0
 
         for game in games:
             point = self.train(game)
-            total_point += point
+            if point is not None:
+                total_point += point
 
         return total_point
 
@@ -130,22 +281,90 @@ class Predictor(object):
             rosters: Tuple[Roster, Roster] = None,
             match_format: str = 'regular') -> PScores:
         """Predict the scores of a given match."""
-        if match_format == 'regular':
-            drawables = [True, False, True, False]
-            return self._predict_bo_match_score(teams, rosters,
-                                                drawables=drawables)
-        elif match_format == 'title':
-            drawables = [False, False, True, True, False]
-            return self._predict_bo_match_score(teams, rosters,
-                                                drawables=drawables)
-        else:
-            raise NotImplementedError
+        key = ('score', self.rating_version, tuple(teams),
+               _rosters_key(rosters), match_format)
+        p_scores = self.match_cache.get(
+            key, lambda: dict(self._predict_match_score(teams, rosters,
+                                                        match_format)))
+        return dict(p_scores)
 
     def predict_match(
             self, teams: Tuple[str, str],
             rosters: Tuple[Roster, Roster] = None,
             match_format: str = 'regular') -> Tuple[float, float]:
         """Predict the win probability & diff expectation of a given match."""
+        key = ('match', self.rating_version, tuple(teams),
+               _rosters_key(rosters), match_format)
+        return self.match_cache.get(
+            key, lambda: self._predict_match(teams, rosters, match_format))
+
+    def predict_many(self, teams: Sequence[Tuple[str, str]],
+                     rosters: Sequence[Tuple[Roster, Roster]] = None,
+                     drawable: bool = False
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given pairs of teams, return arrays of win/draw probabilities of
+        them."""
+        if rosters is None:
+            rosters = [None] * len(teams)
+
+        p_wins = np.zeros(len(teams))
+        p_draws = np.zeros(len(teams))
+        for i, (pair, pair_rosters) in enumerate(zip(teams, rosters)):
+            p_wins[i], p_draws[i] = self.predict(pair, pair_rosters,
+                                                 drawable=drawable)
+
+        return p_wins, p_draws
+
+    def predict_many_both(self, teams: Sequence[Tuple[str, str]],
+                          rosters: Sequence[Tuple[Roster, Roster]] = None
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given pairs of teams, return (pairs, 2) arrays of win/draw
+        probabilities of them on undrawable and drawable maps."""
+        p_undrawable = np.stack(self.predict_many(teams, rosters,
+                                                  drawable=False), axis=1)
+        p_drawable = np.stack(self.predict_many(teams, rosters,
+                                                drawable=True), axis=1)
+        return p_undrawable, p_drawable
+
+    def predict_match_score_batch(
+            self, teams: Sequence[Tuple[str, str]],
+            rosters: Sequence[Tuple[Roster, Roster]] = None,
+            match_format: str = 'regular'
+    ) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+        """Predict the scores of many matches at once. Return the possible
+        scores and their (matches, scores) probabilities."""
+        if match_format not in MATCH_DRAWABLES:
+            raise NotImplementedError
+
+        p_undrawable, p_drawable = self.predict_many_both(teams, rosters)
+        return bo_match_scores(p_undrawable, p_drawable,
+                               MATCH_DRAWABLES[match_format])
+
+    def predict_match_batch(
+            self, teams: Sequence[Tuple[str, str]],
+            rosters: Sequence[Tuple[Roster, Roster]] = None,
+            match_format: str = 'regular') -> Tuple[np.ndarray, np.ndarray]:
+        """Predict the win probabilities & diff expectations of many matches
+        at once."""
+        scores, p_scores = self.predict_match_score_batch(
+            teams, rosters, match_format=match_format)
+        scores = np.array(scores).reshape(-1, 2)
+        diffs = scores[:, 0] - scores[:, 1]
+
+        return p_scores[:, diffs > 0].sum(axis=1), p_scores @ diffs
+
+    def _predict_match_score(self, teams: Tuple[str, str],
+                             rosters: Tuple[Roster, Roster],
+                             match_format: str) -> PScores:
+        if match_format not in MATCH_DRAWABLES:
+            raise NotImplementedError
+
+        return self._predict_bo_match_score(
+            teams, rosters, drawables=MATCH_DRAWABLES[match_format])
+
+    def _predict_match(self, teams: Tuple[str, str],
+                       rosters: Tuple[Roster, Roster],
+                       match_format: str) -> Tuple[float, float]:
         p_scores = self.predict_match_score(teams, rosters,
                                             match_format=match_format)
         p_win = 0.0
@@ -158,143 +377,235 @@ class Predictor(object):
 
         return p_win, e_diff
 
-    def predict_stage(self, games: Sequence[Game]):
-        games = [game for game in games if game.stage == self.stage and
-                 game.match_format == 'regular']
-        prediction = self._predict_stage(games)
-        teams = list(prediction.keys())
-
-        # Normalize 0% and 100% for predictions.
-        wins = {team: (self.stage_wins[team], self.stage_map_diffs[team])
-                for team in teams}
-        min_wins = wins.copy()
-        max_wins = wins.copy()
-
-        for game in games:
-            for team in game.teams:
-                win, map_diff = min_wins[team]
-                min_wins[team] = (win, map_diff - 4)
-
-                win, map_diff = max_wins[team]
-                max_wins[team] = (win + 1, map_diff + 4)
-
-        min_3rd_wins = list(sorted(min_wins.values()))[-3]
-        max_4th_wins = list(sorted(max_wins.values()))[-4]
-
-        for team, (p_top3, p_top1) in prediction.items():
-            if max_wins[team] < min_3rd_wins:
-                p_top3 = False
+    def predict_stage(self, games: Sequence[Game], precision: float = None,
+                      seed: int = None, workers: int = 1,
+                      exact_states: int = EXACT_STATES,
+                      reduce_variance: bool = False):
+        """Predict top 3 & top 1 probabilities of the current stage. If
+        precision is given, simulate until their standard errors are below
+        it instead of a fixed number of iterations, in a single process. The
+        fixed iterations are split across workers processes, and the result
+        is reproducible for a given seed and number of workers. When the
+        remaining games have at most exact_states outcomes, the
+        probabilities are computed exactly instead. With reduce_variance,
+        the games are sampled stratified and tie-breaker coin flips and
+        title matches are weighted rather than sampled, which takes about
+        3.5x fewer iterations for the same precision, 2x at precision 0.01
+        where at least 2000 iterations estimate the standard errors (30
+        games left in Stage 2)."""
+        if precision is not None:
+            if workers != 1:
+                raise ValueError('Simulating until a precision does not '
+                                 'support workers')
+            return self.predict_stage_intervals(
+                games, precision=precision, seed=seed,
+                exact_states=exact_states,
+                reduce_variance=reduce_variance).probabilities
+
+        games = self._remaining_stage_games(games)
+        clinched, eliminated = self._decided_teams(games)
+        prediction = self._predict_stage(games, seed=seed, workers=workers,
+                                         eliminated=eliminated,
+                                         exact_states=exact_states,
+                                         reduce_variance=reduce_variance)
+        return self._normalize_stage_prediction(prediction, clinched,
+                                                eliminated)
+
+    def predict_stage_intervals(self, games: Sequence[Game],
+                                precision: float = 0.01,
+                                confidence: float = 0.95,
+                                max_iters: int = 1000000,
+                                seed: int = None,
+                                exact_states: int = EXACT_STATES,
+                                reduce_variance: bool = False
+                                ) -> StagePrediction:
+        """Predict top 3 & top 1 probabilities of the current stage with
+        their confidence intervals, simulating until all standard errors are
+        below precision. Exact probabilities (see predict_stage) have empty
+        intervals and 0 iterations. Variance reduced probabilities have
+        normal intervals."""
+        games = self._remaining_stage_games(games)
+        clinched, eliminated = self._decided_teams(games)
+        simulator = self._stage_simulator(games, eliminated=eliminated)
+
+        if simulator.n_states <= exact_states:
+            p_top3, p_top1 = simulator.solve()
+            iters = 0
+            top3_lower = top3_upper = p_top3
+            top1_lower = top1_upper = p_top1
+        elif reduce_variance:
+            estimate = simulator.estimate_until(
+                precision, max_iters=max_iters,
+                rng=np.random.default_rng(seed))
+            p_top3, p_top1, iters = (estimate.top3, estimate.top1,
+                                     estimate.iters)
+
+            z = ndtri(0.5 + confidence / 2.0)
+            top3_lower, top3_upper = normal_intervals(
+                p_top3, estimate.top3_errors, z)
+            top1_lower, top1_upper = normal_intervals(
+                p_top1, estimate.top1_errors, z)
+        else:
+            top3_count, top1_count, iters = simulator.simulate_until(
+                precision, max_iters=max_iters,
+                rng=np.random.default_rng(seed))
+            p_top3, p_top1 = top3_count / iters, top1_count / iters
+
+            z = ndtri(0.5 + confidence / 2.0)
+            top3_lower, top3_upper = wilson_intervals(top3_count, iters, z)
+            top1_lower, top1_upper = wilson_intervals(top1_count, iters, z)
+
+        prediction = {team: (top3, top1)
+                      for team, top3, top1 in zip(simulator.teams,
+                                                  p_top3.tolist(),
+                                                  p_top1.tolist())}
+        prediction = self._normalize_stage_prediction(prediction, clinched,
+                                                      eliminated)
+        intervals = {team: ((0.0, 0.0), (0.0, 0.0)) for team in eliminated}
+
+        for i, team in enumerate(simulator.teams):
+            p_top3, p_top1 = prediction[team]
+            top3_interval = (float(top3_lower[i]), float(top3_upper[i]))
+            top1_interval = (float(top1_lower[i]), float(top1_upper[i]))
+
+            # Decided outcomes are certain.
+            if isinstance(p_top3, bool):
+                top3_interval = (float(p_top3), float(p_top3))
+            if isinstance(p_top1, bool):
+                top1_interval = (float(p_top1), float(p_top1))
+
+            intervals[team] = (top3_interval, top1_interval)
+
+        return StagePrediction(probabilities=prediction, intervals=intervals,
+                               iters=iters)
+
+    def simulate_stage(self, games: Sequence[Game], iters: int = 100000,
+                       seed: int = None) -> StageScenarios:
+        """Simulate the current stage and keep the sampled scenarios, which
+        answer what-if questions about the remaining matches.
+        Eliminated teams are kept, so are their matches."""
+        games = self._remaining_stage_games(games)
+        simulator = self._stage_simulator(games)
+        return simulator.sample_scenarios(iters,
+                                          rng=np.random.default_rng(seed))
+
+    def _remaining_stage_games(self, games: Sequence[Game]) -> List[Game]:
+        return [game for game in games if game.stage == self.stage and
+                game.match_format == 'regular']
+
+    def _decided_teams(self, games: Sequence[Game]
+                       ) -> Tuple[Set[str], Set[str]]:
+        """Return the teams which have clinched and the teams which have been
+        eliminated from the top 3, given the remaining games."""
+        teams = sorted(self._stage_teams())
+        indices = {team: i for i, team in enumerate(teams)}
+
+        clinched, eliminated = decided_teams(
+            wins=self.stage_standings.vector('wins', teams).tolist(),
+            map_diffs=self.stage_standings.vector('map_diffs',
+                                                  teams).tolist(),
+            games=[(indices[team1], indices[team2])
+                   for team1, team2 in (game.teams for game in games)])
+
+        return (set(teams[i] for i in clinched),
+                set(teams[i] for i in eliminated))
+
+    def _normalize_stage_prediction(self, prediction, clinched: Set[str],
+                                    eliminated: Set[str]):
+        """Replace certain probabilities of a stage prediction with True or
+        False."""
+        for team in eliminated:
+            prediction[team] = (False, False)
+
+        for team in clinched:
+            p_top3, p_top1 = prediction[team]
+            p_top3 = True
+
+            if self.stage_title_losses[team] > 0:
                 p_top1 = False
-            elif min_wins[team] > max_4th_wins:
-                p_top3 = True
-
-                if self.stage_title_losses[team] > 0:
-                    p_top1 = False
-                elif self.stage_finished:
-                    p_top1 = True
+            elif self.stage_finished:
+                p_top1 = True
 
             prediction[team] = (p_top3, p_top1)
 
         return prediction
 
-    def _predict_stage(self, games: Sequence[Game], iters=100000):
-        teams = self._stage_teams()
-
-        scores_list, cum_weights_list = self._games_scores_cum_weights(games)
-        p_wins_regular = self._p_wins(teams, match_format='regular')
-        p_wins_title = self._p_wins(teams, match_format='title')
-
-        top3_count = {team: 0 for team in teams}
-        top1_count = {team: 0 for team in teams}
-
-        for i in range(iters):
-            wins = self.stage_wins.copy()
-            map_diffs = self.stage_map_diffs.copy()
-            head_to_head_map_diffs = self.stage_head_to_head_map_diffs.copy()
-
-            for game, scores, cum_weights in zip(games,
-                                                 scores_list,
-                                                 cum_weights_list):
-                team1, team2 = game.teams
-                score1, score2 = choices(scores, cum_weights=cum_weights)[0]
+    def _predict_stage(self, games: Sequence[Game], iters=100000,
+                       seed: int = None, workers: int = 1,
+                       eliminated: Set[str] = (),
+                       exact_states: int = EXACT_STATES,
+                       reduce_variance: bool = False):
+        simulator = self._stage_simulator(games, eliminated=eliminated)
 
-                if score1 > score2:
-                    wins[team1] += 1
-                elif score1 < score2:
-                    wins[team2] += 1
-
-                map_diff = score1 - score2
-                map_diffs[team1] += map_diff
-                map_diffs[team2] -= map_diff
-
-                head_to_head_map_diffs[(team1, team2)] += map_diff
-                head_to_head_map_diffs[(team2, team1)] -= map_diff
-
-            # Determine top 3 teams.
-            top3 = self._top3_teams(teams, wins, map_diffs,
-                                    head_to_head_map_diffs, p_wins_regular)
-            for team in top3:
-                top3_count[team] += 1
-
-            # Determine top 1 teams.
-            first, second, third = top3
+        if simulator.n_states <= exact_states:
+            p_top3, p_top1 = simulator.solve()
+        else:
+            top3_count, top1_count = simulator.simulate_parallel(
+                iters, workers=workers, seed=seed,
+                reduce_variance=reduce_variance)
+            p_top3, p_top1 = top3_count / iters, top1_count / iters
+
+        return {team: (top3, top1)
+                for team, top3, top1 in zip(simulator.teams,
+                                            p_top3.tolist(),
+                                            p_top1.tolist())}
+
+    def _stage_simulator(self, games: Sequence[Game],
+                         eliminated: Set[str] = ()) -> StageSimulator:
+        """Build a simulator of the given remaining games of the stage.
+        Eliminated teams are left out of the standings, and so are the games
+        between them."""
+        teams = sorted(self._stage_teams() - set(eliminated))
+        indices = {team: i for i, team in enumerate(teams)}
+        indices.update((team, -1) for team in eliminated)
+        games = [game for game in games if game.stage == self.stage and
+                 not set(game.teams) <= set(eliminated)]
 
-            if self.stage_title_wins[second] > 0:
-                pass
-            elif self.stage_title_wins[third] > 0:
-                second = third
-            elif random() < p_wins_title[(third, second)]:
-                second = third
+        standings = self.stage_standings
+        wins = standings.vector('wins', teams)
+        map_diffs = standings.vector('map_diffs', teams)
+        title_wins = standings.vector('title_wins', teams)
+        head_to_head_map_diffs = standings.matrix('head_to_head_map_diffs',
+                                                  teams)
 
-            if self.stage_title_wins[first] > 0:
-                pass
-            elif self.stage_title_wins[second] > 1:
-                first = second
-            elif random() < p_wins_title[(second, first)]:
-                first = second
+        # Pad the score outcomes of all games to the same length.
+        scores_list, cum_weights_list = self._games_scores_cum_weights(games)
+        n_scores = max((len(scores) for scores in scores_list), default=1)
+        game_teams = np.zeros((len(games), 2), dtype=int)
+        game_scores = np.zeros((len(games), n_scores, 2), dtype=int)
+        game_cum_weights = np.ones((len(games), n_scores))
+
+        for i, (game, scores, cum_weights) in enumerate(
+                zip(games, scores_list, cum_weights_list)):
+            game_teams[i] = [indices[team] for team in game.teams]
+            game_scores[i, :len(scores)] = scores
+            game_cum_weights[i, :len(cum_weights)] = cum_weights
+            game_cum_weights[i, len(cum_weights):] = cum_weights[-1]
 
-            top1_count[first] += 1
+        p_wins_regular = self._p_wins(teams, match_format='regular')
+        p_wins_title = self._p_wins(teams, match_format='title')
 
-        return {team: (top3_count[team] / iters, top1_count[team] / iters)
-                for team in teams}
+        return StageSimulator(
+            teams=teams, wins=wins, map_diffs=map_diffs,
+            head_to_head_map_diffs=head_to_head_map_diffs,
+            title_wins=title_wins, game_teams=game_teams,
+            game_scores=game_scores, game_cum_weights=game_cum_weights,
+            p_wins_regular=[[p_wins_regular[(team1, team2)]
+                             for team2 in teams] for team1 in teams],
+            p_wins_title=[[p_wins_title[(team1, team2)]
+                           for team2 in teams] for team1 in teams],
+            match_ids=[game.match_id for game in games])
 
     def _predict_bo_match_score(self, teams: Tuple[str, str],
                                 rosters: Tuple[Roster, Roster],
-                                drawables: List[bool]) -> PScores:
+                                drawables: Sequence[bool]) -> PScores:
         """Predict the scores of a given BO match."""
-        p_scores = defaultdict(float)
-        p_scores[(0, 0)] = 1.0
-
-        p_undrawable = self.predict(teams, rosters, drawable=False)
-        p_drawable = self.predict(teams, rosters, drawable=True)
-
-        for drawable in drawables:
-            p_win, p_draw = p_drawable if drawable else p_undrawable
-            p_loss = 1.0 - p_win - p_draw
-            new_p_scores = defaultdict(float)
-
-            for (score1, score2), p in p_scores.items():
-                new_p_scores[(score1 + 1, score2)] += p * p_win
-                new_p_scores[(score1, score2 + 1)] += p * p_loss
-                if drawable:
-                    new_p_scores[(score1, score2)] += p * p_draw
-
-            p_scores = new_p_scores
-
-        # Add a tie-breaker game if needed.
-        p_win, p_draw = p_undrawable
-        new_p_scores = defaultdict(float)
-
-        for (score1, score2), p in p_scores.items():
-            if score1 == score2:
-                new_p_scores[(score1 + 1, score2)] += p * p_win
-                new_p_scores[(score1, score2 + 1)] += p * p_loss
-            else:
-                new_p_scores[(score1, score2)] += p
-
-        p_scores = new_p_scores
+        p_undrawable, p_drawable = self.predict_both(teams, rosters)
 
-        return p_scores
+        scores, p_scores = bo_match_scores(np.array([p_undrawable]),
+                                           np.array([p_drawable]),
+                                           drawables)
+        return dict(zip(scores, p_scores[0].tolist()))
 
     def _update_rosters(self, game: Game) -> None:
         for team, roster in zip(game.teams, game.rosters):
@@ -311,12 +622,7 @@ class Predictor(object):
                 self.base_stage = stage
                 self.stage = stage
 
-                self.stage_wins.clear()
-                self.stage_losses.clear()
-                self.stage_map_diffs.clear()
-                self.stage_head_to_head_map_diffs.clear()
-                self.stage_title_wins.clear()
-                self.stage_title_losses.clear()
+                self.stage_standings.clear()
 
     def _update_match_ids(self, match_id: int, teams: Tuple[str, str]) -> None:
         if match_id != self.match_id:
@@ -343,110 +649,63 @@ class Predictor(object):
             else:
                 loser, winner = game.teams
 
-            self.map_diffs[winner] += 1
-            self.map_diffs[loser] -= 1
-            self.head_to_head_map_diffs[(winner, loser)] += 1
-            self.head_to_head_map_diffs[(loser, winner)] -= 1
+            standings = self.standings
+            standings.add('map_diffs', winner, 1)
+            standings.add('map_diffs', loser, -1)
+            standings.add_pair('head_to_head_map_diffs', winner, loser, 1)
+            standings.add_pair('head_to_head_map_diffs', loser, winner, -1)
 
+            stage_standings = self.stage_standings
             if not is_title:
-                self.stage_map_diffs[winner] += 1
-                self.stage_map_diffs[loser] -= 1
-                self.stage_head_to_head_map_diffs[(winner, loser)] += 1
-                self.stage_head_to_head_map_diffs[(loser, winner)] -= 1
+                stage_standings.add('map_diffs', winner, 1)
+                stage_standings.add('map_diffs', loser, -1)
+                stage_standings.add_pair('head_to_head_map_diffs',
+                                         winner, loser, 1)
+                stage_standings.add_pair('head_to_head_map_diffs',
+                                         loser, winner, -1)
+
+            wins, losses = (('title_wins', 'title_losses') if is_title
+                            else ('wins', 'losses'))
 
             # Handle the match result.
             if self.score[winner] == self.score[loser]:
                 # The winner won the match.
-                if is_title:
-                    self.stage_title_wins[winner] += 1
-                    self.stage_title_losses[loser] += 1
-                else:
-                    self.stage_wins[winner] += 1
-                    self.stage_losses[loser] += 1
+                stage_standings.add(wins, winner, 1)
+                stage_standings.add(losses, loser, 1)
             elif self.score[winner] == self.score[loser] - 1:
                 # The winner avoided the loss.
-                if is_title:
-                    self.stage_title_wins[loser] -= 1
-                    self.stage_title_losses[winner] -= 1
-                else:
-                    self.stage_wins[loser] -= 1
-                    self.stage_losses[winner] -= 1
+                stage_standings.add(wins, loser, -1)
+                stage_standings.add(losses, winner, -1)
 
             self.score[winner] += 1
 
-    def _update_draws(self, game: Game) -> None:
-        if game.drawable:
-            _, p_draw = self.predict(game.teams, game.rosters, drawable=True)
-            self.expected_draws += p_draw
-        if game.score[0] == game.score[1]:
-            self.real_draws += 1.0
-
     def _stage_teams(self) -> Set[str]:
-        teams = set()
-        for (stage, _), team_members in self.availabilities.items():
-            if stage != self.stage:
-                continue
-            teams.update(team_members.keys())
-
-        return teams
+        return set(self.availabilities.stage_teams(self.stage))
 
     def _games_scores_cum_weights(self, games: Sequence[Game]):
-        scores_list = []
-        cum_weights_list = []
-
-        for game in games:
-            if game.stage != self.stage:
-                continue
-
-            p_scores = self.predict_match_score(game.teams)
-            scores = []
-            cum_weights = []
-            cum_weight = 0.0
-
-            for score, p in p_scores.items():
-                scores.append(score)
-                cum_weight += p
-                cum_weights.append(cum_weight)
-
-            scores_list.append(scores)
-            cum_weights_list.append(cum_weights)
+        games = [game for game in games if game.stage == self.stage]
+        scores_list = [None] * len(games)
+        cum_weights_list = [None] * len(games)
+
+        # Predict the games of every match format at once.
+        for match_format in set(game.match_format for game in games):
+            indices = [i for i, game in enumerate(games)
+                       if game.match_format == match_format]
+            scores, p_scores = self.predict_match_score_batch(
+                [games[i].teams for i in indices], match_format=match_format)
+            cum_weights = np.cumsum(p_scores, axis=1).tolist()
+
+            for i, game_cum_weights in zip(indices, cum_weights):
+                scores_list[i] = scores
+                cum_weights_list[i] = game_cum_weights
 
         return scores_list, cum_weights_list
 
     def _p_wins(self, teams: Sequence[str], match_format: str):
-        p_wins = {}
-
-        for team1 in teams:
-            for team2 in teams:
-                team_pair = (team1, team2)
-                p_win, _ = self.predict_match(team_pair,
-                                              match_format=match_format)
-                p_wins[team_pair] = p_win
-
-        return p_wins
-
-    def _top3_teams(self, teams, wins, map_diffs, head_to_head_map_diffs,
-                    p_wins_regular):
-        def cmp_team(team1, team2):
-            if wins[team1] < wins[team2]:
-                return -1
-            elif wins[team1] > wins[team2]:
-                return 1
-            elif map_diffs[team1] < map_diffs[team2]:
-                return -1
-            elif map_diffs[team1] > map_diffs[team2]:
-                return 1
-            elif head_to_head_map_diffs[(team1, team2)] < 0:
-                return -1
-            elif head_to_head_map_diffs[(team1, team2)] > 0:
-                return 1
-            elif random() < p_wins_regular[(team1, team2)]:
-                return 1
-            else:
-                return -1
-
-        teams = list(sorted(teams, key=cmp_to_key(cmp_team), reverse=True))
-        return teams[:3]
+        team_pairs = [(team1, team2) for team1 in teams for team2 in teams]
+        p_wins, _ = self.predict_match_batch(team_pairs,
+                                             match_format=match_format)
+        return dict(zip(team_pairs, p_wins.tolist()))
 
 
 class SimplePredictor(Predictor):
@@ -492,14 +751,21 @@ class TrueSkillPredictor(Predictor):
 
     def __init__(self, mu: float = 2500.0, sigma: float = 2500.0 / 3.0,
                  beta: float = 2500.0 / 2.0, tau: float = 25.0 / 3.0,
-                 draw_probability: float = 0.06, **kws) -> None:
+                 draw_probability: float = 0.06,
+                 verify_updates: bool = False, **kws) -> None:
         super().__init__(**kws)
 
         self.env_drawable = TrueSkill(mu=mu, sigma=sigma, beta=beta, tau=tau,
                                       draw_probability=draw_probability)
         self.env_undrawable = TrueSkill(mu=mu, sigma=sigma, beta=beta, tau=tau,
                                         draw_probability=0.0)
-        self.ratings = self._create_rating_jar()
+        self.rating_store = RatingStore(mu=mu, sigma=sigma)
+        self.ratings = self.rating_store.jar()
+
+        # (drawable, number of players) => draw margin
+        self.draw_margins = {}
+        # Check every update against the factor graph of trueskill.
+        self.verify_updates = verify_updates
 
     def _train(self, game: Game) -> None:
         """Given a game result, train the underlying model.
@@ -513,41 +779,194 @@ class TrueSkillPredictor(Predictor):
             ranks = [1, 0]  # Team 2 wins.
 
         env = self.env_drawable if game.drawable else self.env_undrawable
-        teams_ratings = env.rate(self._teams_ratings(game.teams, game.rosters),
-                                 ranks=ranks)
-        self._update_teams_ratings(game, teams_ratings)
+        teams_ids = self._teams_ids(game.teams, game.rosters)
+        if self.verify_updates:
+            expected = env.rate(self._teams_ratings(teams_ids), ranks=ranks)
+
+        winner_ids, loser_ids = (teams_ids if score1 >= score2
+                                 else teams_ids[::-1])
+        draw_margin = self._draw_margin(game.drawable,
+                                        len(winner_ids) + len(loser_ids))
+        self.rating_store.rate(env, winner_ids, loser_ids,
+                               drawn=score1 == score2,
+                               draw_margin=draw_margin)
+
+        if self.verify_updates:
+            self._verify_ratings(teams_ids, expected)
+        self._update_teams_ratings(game, teams_ids)
 
     def predict(self, teams: Tuple[str, str],
                 rosters: Tuple[Roster, Roster] = None,
                 drawable: bool = False) -> Tuple[float, float]:
         """Given two teams, return win/draw probabilities of them."""
-        env = self.env_drawable if drawable else self.env_undrawable
-
-        team1_ratings, team2_ratings = self._teams_ratings(teams, rosters)
-        size = len(team1_ratings) + len(team2_ratings)
+        delta_mu, denom, size = self._predict_stats(teams, rosters)
+        p_win, p_draw = _win_draw(delta_mu, denom,
+                                  self._draw_margin(drawable, size))
+        return float(p_win), float(p_draw)
+
+    def predict_both(self, teams: Tuple[str, str],
+                     rosters: Tuple[Roster, Roster] = None) -> PBoth:
+        """Given two teams, return win/draw probabilities of them on
+        undrawable and drawable maps, from the same sums of ratings."""
+        delta_mu, denom, size = self._predict_stats(teams, rosters)
+        draw_margins = np.array([self._draw_margin(False, size),
+                                 self._draw_margin(True, size)])
+        p_wins, p_draws = _win_draw(delta_mu, denom, draw_margins)
+        p_wins = p_wins.tolist()
+        p_draws = p_draws.tolist()
+        return (p_wins[0], p_draws[0]), (p_wins[1], p_draws[1])
+
+    def predict_many(self, teams: Sequence[Tuple[str, str]],
+                     rosters: Sequence[Tuple[Roster, Roster]] = None,
+                     drawable: bool = False
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given pairs of teams, return arrays of win/draw probabilities of
+        them, computed at once."""
+        delta_mu, denom, sizes = self._predict_many_stats(teams, rosters)
+        return _win_draw(delta_mu, denom,
+                         self._draw_margins_of(drawable, sizes))
+
+    def predict_many_both(self, teams: Sequence[Tuple[str, str]],
+                          rosters: Sequence[Tuple[Roster, Roster]] = None
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given pairs of teams, return (pairs, 2) arrays of win/draw
+        probabilities of them on undrawable and drawable maps, from the same
+        sums of ratings."""
+        delta_mu, denom, sizes = self._predict_many_stats(teams, rosters)
+        return tuple(np.stack(_win_draw(delta_mu, denom,
+                                        self._draw_margins_of(drawable,
+                                                              sizes)),
+                              axis=1)
+                     for drawable in (False, True))
+
+    def _predict_stats(self, teams: Tuple[str, str],
+                       rosters: Tuple[Roster, Roster]
+                       ) -> Tuple[float, float, int]:
+        """Return the difference of the mu sums of two teams, the standard
+        deviation of their performance difference and their number of
+        players, which are all the predictions depend on."""
+        # Gather the ratings of both teams at once.
+        names1, names2 = self._teams_names(teams, rosters)
+        ids = self.rating_store.ids(names1 + names2)
+        mu = self.rating_store.mu[ids]
+        sigma = self.rating_store.sigma[ids]
+        size = len(ids)
+
+        delta_mu = float(mu @ _pair_signs(len(names1), len(names2)))
+        sum_sigma = float(sigma @ sigma)
+        denom = sqrt(size * self.env_drawable.beta**2 + sum_sigma)
+        return delta_mu, denom, size
+
+    def _predict_many_stats(self, teams: Sequence[Tuple[str, str]],
+                            rosters: Sequence[Tuple[Roster, Roster]]
+                            ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the arrays of _predict_stats of pairs of teams."""
+        if rosters is None:
+            rosters = [None] * len(teams)
+        n_pairs = len(teams)
+
+        # Gather the ratings of all the teams at once, then sum them by team
+        # of every pair, with a sign.
+        ids = []
+        lengths = []
+        for pair, pair_rosters in zip(teams, rosters):
+            for team_ids in self._teams_ids(pair, pair_rosters):
+                ids.append(team_ids)
+                lengths.append(len(team_ids))
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64).reshape(n_pairs, 2)
+
+        mu = self.rating_store.mu[ids]
+        sigma = self.rating_store.sigma[ids]
+        pairs = np.repeat(np.arange(n_pairs), lengths.sum(axis=1))
+        signs = np.repeat(np.tile([1.0, -1.0], n_pairs), lengths.ravel())
+        delta_mu = np.bincount(pairs, weights=signs * mu, minlength=n_pairs)
+        sum_sigma = np.bincount(pairs, weights=np.square(sigma),
+                                minlength=n_pairs)
+        sizes = lengths.sum(axis=1)
+
+        denom = np.sqrt(sizes * self.env_drawable.beta**2 + sum_sigma)
+        return delta_mu, denom, sizes
+
+    def _teams_names(self, teams: Tuple[str, str],
+                     rosters: Tuple[Roster, Roster]
+                     ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """Return the names of the ratings of both teams."""
+        return (teams[0],), (teams[1],)
+
+    def _teams_ids(self, teams: Tuple[str, str],
+                   rosters: Tuple[Roster, Roster]
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ids of the ratings of both teams."""
+        return tuple(self.rating_store.ids(names)
+                     for names in self._teams_names(teams, rosters))
+
+    def _teams_ratings(self, teams_ids: Tuple[np.ndarray, np.ndarray]
+                       ) -> Tuple[List[Rating], List[Rating]]:
+        mu = self.rating_store.mu
+        sigma = self.rating_store.sigma
+        return tuple([Rating(mu=mu[i], sigma=sigma[i]) for i in ids.tolist()]
+                     for ids in teams_ids)
+
+    def _update_teams_ratings(self, game: Game,
+                              teams_ids: Tuple[np.ndarray, np.ndarray]
+                              ) -> None:
+        """Update anything derived from the ratings of a trained game."""
+        pass
 
-        delta_mu = (sum(r.mu for r in team1_ratings) -
-                    sum(r.mu for r in team2_ratings))
-        draw_margin = calc_draw_margin(env.draw_probability, size, env=env)
-        sum_sigma = sum(r.sigma**2 for r in chain(team1_ratings,
-                                                  team2_ratings))
-        denom = sqrt(size * env.beta**2 + sum_sigma)
+    def _draw_margin(self, drawable: bool, size: int) -> float:
+        """Return the draw margin of games between size players in total,
+        computed once by environment and size."""
+        key = (drawable, size)
+        draw_margin = self.draw_margins.get(key)
+        if draw_margin is None:
+            env = self.env_drawable if drawable else self.env_undrawable
+            draw_margin = calc_draw_margin(env.draw_probability, size,
+                                           env=env)
+            self.draw_margins[key] = draw_margin
+        return draw_margin
+
+    def _draw_margins_of(self, drawable: bool,
+                         sizes: np.ndarray) -> np.ndarray:
+        draw_margins = np.zeros(len(sizes))
+        for size in np.unique(sizes).tolist():
+            draw_margins[sizes == size] = self._draw_margin(drawable, size)
+        return draw_margins
+
+    def _verify_ratings(self, teams_ids: Tuple[np.ndarray, np.ndarray],
+                        expected) -> None:
+        """Raise AssertionError unless the ratings of both teams agree with
+        the expected ones to 1e-9."""
+        for ids, ratings in zip(teams_ids, expected):
+            actual = np.stack([self.rating_store.mu[ids],
+                               self.rating_store.sigma[ids]])
+            ratings = np.array([[rating.mu for rating in ratings],
+                                [rating.sigma for rating in ratings]])
+            if not np.allclose(actual, ratings, rtol=1e-9, atol=1e-9):
+                error = float(np.abs(actual - ratings).max())
+                raise AssertionError(f'Ratings differ from trueskill by '
+                                     f'{error:g}')
 
-        p_win = env.cdf((delta_mu - draw_margin) / denom)
-        p_not_loss = env.cdf((delta_mu + draw_margin) / denom)
+    def _create_rating_jar(self):
+        return RatingStore(mu=self.env_drawable.mu,
+                           sigma=self.env_drawable.sigma).jar()
 
-        return p_win, p_not_loss - p_win
+    def __getstate__(self):
+        state = super().__getstate__()
 
-    def _teams_ratings(self, teams: Tuple[str, str],
-                       rosters: Tuple[Roster, Roster]):
-        return [self.ratings[teams[0]]], [self.ratings[teams[1]]]
+        # TrueSkill environments cannot be pickled.
+        for name in ['env_drawable', 'env_undrawable']:
+            env = state[name]
+            state[name] = dict(mu=env.mu, sigma=env.sigma, beta=env.beta,
+                               tau=env.tau,
+                               draw_probability=env.draw_probability)
+        return state
 
-    def _update_teams_ratings(self, game: Game, teams_ratings):
-        for team, ratings in zip(game.teams, teams_ratings):
-            self.ratings[team] = ratings[0]
+    def __setstate__(self, state):
+        super().__setstate__(state)
 
-    def _create_rating_jar(self):
-        return defaultdict(lambda: self.env_drawable.create_rating())
+        self.env_drawable = TrueSkill(**state['env_drawable'])
+        self.env_undrawable = TrueSkill(**state['env_undrawable'])
 
 
 class PlayerTrueSkillPredictor(TrueSkillPredictor):
@@ -558,94 +977,290 @@ class PlayerTrueSkillPredictor(TrueSkillPredictor):
         super().__init__(**kws)
 
         self.best_rosters = {}
-        self.ratings_history = OrderedDict()
+
+    @staticmethod
+    def default_observers() -> List[Observer]:
+        return Predictor.default_observers() + [RatingsHistory()]
+
+    @property
+    def ratings_history(self):
+        return self.observer(RatingsHistory).history
 
     def save_ratings_history(self):
         save_ratings_history(self.ratings_history,
                              mu=self.env_drawable.mu,
                              sigma=self.env_drawable.sigma)
 
-    def _teams_ratings(self, teams: Tuple[str, str],
-                       rosters: Tuple[Roster, Roster]):
+    def _teams_names(self, teams: Tuple[str, str],
+                     rosters: Tuple[Roster, Roster]
+                     ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
         if rosters is None:
             # No rosters provided, use the best rosters if possible.
-            rosters = [self.best_rosters.get(team, [''] * 6) for team in teams]
+            rosters = [self.best_rosters.get(team, ('',) * 6)
+                       for team in teams]
 
-        return ([self.ratings[name] for name in rosters[0]],
-                [self.ratings[name] for name in rosters[1]])
-
-    def _update_teams_ratings(self, game: Game, teams_ratings) -> None:
-        for team, roster, ratings in zip(game.teams, game.rosters,
-                                         teams_ratings):
-            for name, rating in zip(roster, ratings):
-                self.ratings[name] = rating
+        return tuple(rosters[0]), tuple(rosters[1])
 
+    def _update_teams_ratings(self, game: Game,
+                              teams_ids: Tuple[np.ndarray, np.ndarray]
+                              ) -> None:
+        for team in game.teams:
             self.ratings[team] = self._record_team_ratings(team)
 
     def _record_team_ratings(self, team: str) -> Rating:
         match_number = len(self.match_history[self.stage][team])
-        match_key = (self.stage, match_number)
-
-        members = self.availabilities[match_key][team]
-        if match_key not in self.ratings_history:
-            self.ratings_history[match_key] = {}
-        ratings = self.ratings_history[match_key]
-
-        # Record player ratings.
-        for name in members:
-            ratings[name] = self.ratings[name]
+        members = self.availabilities.mask(self.stage, match_number, team)
 
-        # Update the best roster.
+        # Update the best roster, which gives the team rating.
         best_roster = self._update_best_roster(team, members)
+        return self._roster_rating(best_roster)
 
-        # Record the team rating.
-        rating = self._roster_rating(best_roster)
-        ratings[team] = rating
-        return rating
-
-    def _update_best_roster(self, team: str, members: Set[str]):
-        rosters = sorted(self.roster_queues[team],
-                         key=lambda roster: self._min_roster_rating(roster),
-                         reverse=True)
+    def _update_best_roster(self, team: str, members: int):
+        availabilities = self.availabilities
         best_roster = None
 
-        for roster in rosters:
-            if all(name in members for name in roster):
-                best_roster = roster
-                break
+        # Only rate the distinct recent rosters whose players are all in the
+        # members bitmask.
+        rosters = [roster for roster in dict.fromkeys(self.roster_queues[team])
+                   if availabilities.available(roster, members)]
+
+        if rosters:
+            # Pick the best min rating, the most recent roster on ties.
+            ids = np.array([self.rating_store.ids(tuple(roster))
+                            for roster in rosters])
+            sum_mu = self.rating_store.mu[ids].sum(axis=1)
+            sum_sigma = np.sqrt(
+                np.square(self.rating_store.sigma[ids]).sum(axis=1))
+            min_ratings = (sum_mu - 3.0 * sum_sigma) / 6.0
+            best_roster = rosters[int(np.argmax(min_ratings))]
 
         if best_roster is None:
-            # Just pick the best 6.
-            sorted_members = sorted(members,
-                                    key=lambda name: self._min_rating(name),
-                                    reverse=True)
-            best_roster = tuple(sorted_members[:6])
+            # Pick the best 6 of the members.
+            best_roster = self.best_lineup(availabilities.players(members))
 
         self.best_rosters[team] = best_roster
         return best_roster
 
-    def _roster_rating(self, roster: Roster) -> Tuple[float, float]:
-        sum_mu = sum(self.ratings[name].mu for name in roster)
-        sum_sigma = sqrt(sum(self.ratings[name].sigma**2 for name in roster))
+    def best_lineup(self, members: Sequence[str], opponent: Roster = None,
+                    drawable: bool = False) -> Roster:
+        """Return the 6 members whose roster has the best min rating, or
+        the best win probability against the opponent roster when given,
+        by their own min ratings."""
+        names = list(members)
+        ids = self.rating_store.ids(names)
+        mu = self.rating_store.mu[ids]
+        sigma = self.rating_store.sigma[ids]
+
+        if opponent is None:
+            score = min_rating
+        else:
+            opponent_ids = self.rating_store.ids(tuple(opponent))
+            opponent_mu = float(self.rating_store.mu[opponent_ids].sum())
+            size = min(len(names), 6) + len(opponent_ids)
+            draw_margin = self._draw_margin(drawable, size)
+            # Variances of the opponent and of all the performances.
+            base_var = (float(np.square(
+                self.rating_store.sigma[opponent_ids]).sum()) +
+                        size * self.env_drawable.beta**2)
+
+            def score(sum_mu: np.ndarray, sum_var: np.ndarray) -> np.ndarray:
+                p_wins, _ = _win_draw(sum_mu - opponent_mu,
+                                      np.sqrt(sum_var + base_var),
+                                      draw_margin)
+                return p_wins
+
+        lineup, _ = best_lineup(mu, sigma, score=score)
+        min_ratings = mu[lineup] - 3.0 * sigma[lineup]
+        lineup = lineup[np.argsort(-min_ratings, kind='stable')]
+        return tuple(names[i] for i in lineup.tolist())
+
+    def _roster_rating(self, roster: Roster) -> Rating:
+        ids = self.rating_store.ids(tuple(roster))
+        sum_mu = float(self.rating_store.mu[ids].sum())
+        sum_sigma = sqrt(float(np.square(self.rating_store.sigma[ids]).sum()))
 
         mu = sum_mu / 6.0
         sigma = sum_sigma / 6.0
         return Rating(mu=mu, sigma=sigma)
 
-    def _min_roster_rating(self, roster: Roster) -> float:
-        rating = self._roster_rating(roster)
-        return rating.mu - 3.0 * rating.sigma
 
-    def _min_rating(self, name: str) -> float:
-        rating = self.ratings[name]
-        return rating.mu - 3.0 * rating.sigma
+def bo_match_scores(p_undrawable: np.ndarray, p_drawable: np.ndarray,
+                    drawables: Sequence[bool]
+                    ) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+    """Given (matches, 2) win/draw probabilities of games on undrawable
+    and drawable maps, return the possible scores of BO matches of the given
+    games and their (matches, scores) probabilities. Tied matches go to a
+    tie-breaker game on an undrawable map. Games on undrawable maps are
+    lost when not won, whatever their draw probability, so the
+    probabilities of every match sum to 1."""
+    n_games = len(drawables) + 1
+    p_scores = np.zeros((len(p_undrawable), n_games + 1, n_games + 1))
+    p_scores[:, 0, 0] = 1.0
+
+    for drawable in drawables:
+        p_win, p_draw = (p_drawable if drawable else p_undrawable).T
+        p_loss = 1.0 - p_win - (p_draw if drawable else 0.0)
+        new_p_scores = np.zeros_like(p_scores)
+
+        new_p_scores[:, 1:, :] += p_scores[:, :-1, :] * p_win[:, None, None]
+        new_p_scores[:, :, 1:] += p_scores[:, :, :-1] * p_loss[:, None, None]
+        if drawable:
+            new_p_scores += p_scores * p_draw[:, None, None]
+
+        p_scores = new_p_scores
+
+    # Add a tie-breaker game if needed.
+    p_win = p_undrawable[:, 0]
+    p_loss = 1.0 - p_win
+    ties = np.arange(n_games)
+    p_ties = p_scores[:, ties, ties].copy()
+    p_scores[:, ties, ties] = 0.0
+    p_scores[:, ties + 1, ties] += p_ties * p_win[:, None]
+    p_scores[:, ties, ties + 1] += p_ties * p_loss[:, None]
+
+    scores = _bo_scores(tuple(drawables))
+    return scores, p_scores[:, [s1 for s1, _ in scores],
+                            [s2 for _, s2 in scores]]
+
+
+def _win_draw(delta_mu, denom, draw_margins
+              ) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the win/draw probabilities of TrueSkill for the given
+    differences of mu sums, their standard deviations and draw margins, all
+    broadcast together."""
+    p_wins = ndtr((delta_mu - draw_margins) / denom)
+    p_not_losses = ndtr((delta_mu + draw_margins) / denom)
+    return p_wins, p_not_losses - p_wins
+
+
+def _rosters_key(rosters: Optional[Sequence[Sequence[str]]]
+                 ) -> Optional[Tuple[Roster, Roster]]:
+    """Return rosters as hashable tuples, to key memoized predictions."""
+    if rosters is None:
+        return None
+    return tuple(tuple(roster) for roster in rosters)
+
+
+@lru_cache(maxsize=None)
+def _pair_signs(size1: int, size2: int) -> np.ndarray:
+    """Return the signs summing the ratings of team1 minus team2."""
+    signs = np.concatenate([np.ones(size1), -np.ones(size2)])
+    signs.flags.writeable = False
+    return signs
+
+
+@lru_cache(maxsize=None)
+def _bo_scores(drawables: Tuple[bool, ...]) -> List[Tuple[int, int]]:
+    """Return the possible scores of a BO match of the given games, in the
+    order they are first reached."""
+    scores = {(0, 0): None}
+
+    for drawable in drawables:
+        new_scores = {}
+        for score1, score2 in scores:
+            new_scores[(score1 + 1, score2)] = None
+            new_scores[(score1, score2 + 1)] = None
+            if drawable:
+                new_scores[(score1, score2)] = None
+        scores = new_scores
+
+    # Add a tie-breaker game if needed.
+    new_scores = {}
+    for score1, score2 in scores:
+        if score1 == score2:
+            new_scores[(score1 + 1, score2)] = None
+            new_scores[(score1, score2 + 1)] = None
+        else:
+            new_scores[(score1, score2)] = None
+
+    return list(new_scores)
+
+
+def train_predictor(games: Sequence[Game], class_=PlayerTrueSkillPredictor,
+                    checkpoint: str = None, **kws) -> Predictor:
+    """Return a predictor of class_ created with kws and trained on games.
+    When the checkpoint was saved by the same kind of predictor trained on
+    the first games, resume from it (observers included) and only train on
+    the following ones. Save the checkpoint afterwards. By default, every
+    configuration, observers included, has its own checkpoint."""
+    observers = kws.get('observers') or class_.default_observers()
+    config = dict(predictor_config(class_, **kws),
+                  observers=[type(observer).__name__
+                             for observer in observers],
+                  version=CHECKPOINT_VERSION)
+    if checkpoint is None:
+        checkpoint = os.path.join(
+            CHECKPOINT_DIR, f'{class_.__name__}-{config_hash(config)}.pkl.gz')
+
+    predictor = None
+    if os.path.exists(checkpoint):
+        try:
+            predictor, saved_config = Predictor.load_checkpoint(
+                checkpoint, availabilities=kws.get('availabilities'))
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            predictor = None
+        else:
+            n_games = predictor.n_trained_games
+            if (n_games > len(games) or
+                    saved_config != _checkpoint_config(
+                        config, games[:n_games], predictor.availabilities)):
+                predictor = None
+
+    if predictor is None:
+        predictor = class_(**kws)
+
+    new_games = games[predictor.n_trained_games:]
+    if new_games:
+        predictor.train_games(new_games)
+        predictor.save_checkpoint(
+            checkpoint, config=_checkpoint_config(config, games,
+                                                  predictor.availabilities))
+
+    return predictor
+
+
+def predictor_config(class_=PlayerTrueSkillPredictor, **kws) -> Dict:
+    """Return the parameters which affect the predictions of a predictor of
+    class_ created with kws."""
+    return {'class': class_.__name__,
+            'kws': {key: value for key, value in kws.items()
+                    if key not in ('availabilities', 'observers')}}
+
+
+def _checkpoint_config(config: Dict, games: Sequence[Game],
+                       availabilities: Availabilities) -> Dict:
+    """Identify a predictor by its parameters, the games it was trained on
+    and the availabilities of the teams in their matches."""
+    digest = hashlib.sha1(repr(list(games)).encode()).hexdigest()
+    return dict(config, n_games=len(games), games=digest,
+                availabilities=_availabilities_digest(availabilities, games))
+
+
+def _availabilities_digest(availabilities: Availabilities,
+                           games: Sequence[Game]) -> str:
+    """Return a digest of the players available to every team in the
+    matches of the games, as numbered in their stage."""
+    match_ids = defaultdict(set)
+    for game in games:
+        for team in game.teams:
+            match_ids[(game.stage, team)].add(game.match_id)
+
+    members = []
+    for (stage, team), ids in sorted(match_ids.items()):
+        for match_number in range(1, len(ids) + 1):
+            team_members = availabilities.get((stage, match_number), {})
+            members.append((stage, match_number, team,
+                            sorted(team_members.get(team, ()))))
+
+    text = json.dumps(members)
+    return hashlib.sha1(text.encode()).hexdigest()
 
 
 def optimize_beta(class_=PlayerTrueSkillPredictor, maxfun=100) -> None:
     games, _ = load_games()
 
     def f(x):
-        predictor = class_(beta=x[0])
+        predictor = class_(beta=x[0], observers=[Evaluation()])
         return -predictor.train_games(games)
 
     args = fmin(f, [2500.0 / 6.0], maxfun=maxfun)
@@ -658,7 +1273,7 @@ def optimize_draw_probability(class_=PlayerTrueSkillPredictor,
     games, _ = load_games()
 
     def f(x):
-        predictor = class_(draw_probability=x[0])
+        predictor = class_(draw_probability=x[0], observers=[DrawCounter()])
         predictor.train_games(games)
         return (predictor.expected_draws - predictor.real_draws)**2
 
@@ -675,19 +1290,30 @@ def compare_methods() -> None:
     ]
 
     for class_ in classes:
-        predictor = class_()
-        avg_point = predictor.train_games(games) / len(games)
-        avg_accuracy = np.sum(np.array(predictor.corrects)) / len(games)
+        config = predictor_config(class_)
+
+        # Serve the numbers from the journal, train only when needed.
+        try:
+            avg_point, avg_accuracy = journal_evaluation(config, games)
+        except KeyError:
+            with PredictionJournal(config) as journal:
+                predictor = train_predictor(
+                    games, class_=class_, observers=[Evaluation(), journal])
+                # Resumed from a checkpoint, its own journal was written.
+                predictor.observer(PredictionJournal).close()
+            avg_point = sum(predictor.points) / len(games)
+            avg_accuracy = np.sum(np.array(predictor.corrects)) / len(games)
+
         print(f'{class_.__name__:>30} {avg_point:8.4f} {avg_accuracy:7.3f}')
 
 
-def predict_stage():
-    past_games, future_games = load_games()
+def predict_stage(seed: int = None, workers: int = 1):
+    past_games, _ = load_games()
+    predictor = train_predictor(past_games)
+    future_games = list(iter_games(stage=predictor.stage, played=False))
 
-    predictor = PlayerTrueSkillPredictor()
-    predictor.train_games(past_games)
-
-    p_stage = predictor.predict_stage(future_games)
+    p_stage = predictor.predict_stage(future_games, seed=seed,
+                                      workers=workers)
     teams = sorted(p_stage.keys(), key=lambda team: p_stage[team][-1],
                    reverse=True)
 
@@ -713,9 +1339,7 @@ def predict_stage():
 
 def save_ratings():
     past_games, future_games = load_games()
-
-    predictor = PlayerTrueSkillPredictor()
-    predictor.train_games(past_games)
+    predictor = train_predictor(past_games)
     predictor.save_ratings_history()
 
 
@@ -0,0 +1,139 @@
+from collections.abc import MutableMapping
+from math import sqrt
+from typing import Iterator, Sequence
+
+import numpy as np
+from trueskill import Rating, TrueSkill
+
+from standings import TeamIds
+
+
+class RatingStore(object):
+    """Ratings of players & teams kept in mu and sigma arrays indexed by
+    interned ids. Unknown names get the default rating when interned."""
+
+    def __init__(self, mu: float, sigma: float,
+                 name_ids: TeamIds = None) -> None:
+        super().__init__()
+
+        self.default_mu = mu
+        self.default_sigma = sigma
+        # Names of players and teams share the ids, like keys of a dict.
+        self.name_ids = name_ids if name_ids is not None else TeamIds()
+
+        self._mu = np.zeros(0)
+        self._sigma = np.zeros(0)
+        self._roster_ids = {}
+        self._grow()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_roster_ids'] = {}
+        return state
+
+    @property
+    def mu(self) -> np.ndarray:
+        """The mu of every id, grown as names are interned."""
+        self._grow()
+        return self._mu
+
+    @property
+    def sigma(self) -> np.ndarray:
+        self._grow()
+        return self._sigma
+
+    def id(self, name: str) -> int:
+        return self.name_ids[name]
+
+    def ids(self, names: Sequence[str]) -> np.ndarray:
+        """Return the ids of names, memoized for tuples like rosters."""
+        if not isinstance(names, tuple):
+            return self.name_ids.ids(names)
+
+        ids = self._roster_ids.get(names)
+        if ids is None:
+            ids = self._roster_ids[names] = self.name_ids.ids(names)
+            ids.flags.writeable = False
+        return ids
+
+    def get(self, name: str) -> Rating:
+        name_id = self.id(name)
+        return Rating(mu=float(self.mu[name_id]),
+                      sigma=float(self.sigma[name_id]))
+
+    def set(self, name: str, rating: Rating) -> None:
+        name_id = self.id(name)
+        self.mu[name_id] = rating.mu
+        self.sigma[name_id] = rating.sigma
+
+    def rate(self, env: TrueSkill, winner_ids: np.ndarray,
+             loser_ids: np.ndarray, drawn: bool = False,
+             draw_margin: float = 0.0) -> None:
+        """Update the ratings of two teams after a game, like env.rate but
+        with the closed form of TrueSkill for two teams: the difference of
+        team performances is truncated once, by the v & w functions of env.
+        On a draw, either team may be given as the winner. draw_margin is
+        the one of env for the players of both teams."""
+        ids = np.concatenate([winner_ids, loser_ids])
+        mu = self.mu
+        sigma = self.sigma
+
+        # Prior variances, with the dynamics of env.
+        variance = np.square(sigma[ids]) + env.tau**2
+        c = sqrt(float(variance.sum()) + len(ids) * env.beta**2)
+        diff = float(mu[winner_ids].sum() - mu[loser_ids].sum()) / c
+        margin = draw_margin / c
+
+        if drawn:
+            v = env.v_draw(diff, margin)
+            w = env.w_draw(diff, margin)
+        else:
+            v = env.v_win(diff, margin)
+            w = env.w_win(diff, margin)
+
+        signs = np.ones(len(ids))
+        signs[len(winner_ids):] = -1.0
+        mu[ids] += signs * variance * (v / c)
+        sigma[ids] = np.sqrt(variance * (1.0 - variance * (w / c**2)))
+
+    def jar(self) -> 'RatingJar':
+        return RatingJar(self)
+
+    def _grow(self) -> None:
+        n_names = len(self.name_ids)
+        capacity = len(self._mu)
+        if n_names <= capacity:
+            return
+
+        capacity = max(n_names, 2 * capacity, 64)
+        mu = np.full(capacity, self.default_mu, dtype=float)
+        sigma = np.full(capacity, self.default_sigma, dtype=float)
+        mu[:len(self._mu)] = self._mu
+        sigma[:len(self._sigma)] = self._sigma
+        self._mu = mu
+        self._sigma = sigma
+
+
+class RatingJar(MutableMapping):
+    """Dict-style view of a rating store by name. Like a defaultdict, unknown
+    names get the default rating."""
+
+    def __init__(self, store: RatingStore) -> None:
+        super().__init__()
+        self.store = store
+
+    def __getitem__(self, name: str) -> Rating:
+        return self.store.get(name)
+
+    def __setitem__(self, name: str, rating: Rating) -> None:
+        self.store.set(name, rating)
+
+    def __delitem__(self, name: str) -> None:
+        self.store.set(name, Rating(mu=self.store.default_mu,
+                                    sigma=self.store.default_sigma))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.store.name_ids.teams))
+
+    def __len__(self) -> int:
+        return len(self.store.name_ids)
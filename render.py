@@ -1,7 +1,9 @@
 from collections import defaultdict, OrderedDict
+from datetime import timedelta
 
-from fetcher import load_games
-from predictor import PlayerTrueSkillPredictor
+from fetcher import iter_games, load_games
+from observers import MatchPredictions
+from predictor import PlayerTrueSkillPredictor, train_predictor
 
 
 TEAM_NAMES = {
@@ -54,7 +56,8 @@ RATING_CONFIDENCE = 1.64  # mu ± 1.64 * sigma -> 90% chance.
 
 class MatchCard(object):
     def __init__(self, predictor, match_id, stage, start_time, teams,
-                 score=None, use_date=False, first_team=None) -> None:
+                 score=None, use_date=False, first_team=None,
+                 prediction=None) -> None:
         self.match_id = match_id
         self.stage = stage
         self.start_time = start_time
@@ -75,7 +78,12 @@ class MatchCard(object):
         self.time_str = f'{hour}{minute} {suffix}'
         self.date_str = self.start_time.strftime('%A, %B %d').replace('0', '')
 
-        p_win, e_diff = predictor.predict_match(teams)
+        # Use the prediction made before the match if any.
+        if prediction is None:
+            p_win, e_diff = predictor.predict_match(teams)
+            ratings = [predictor.ratings[team] for team in teams]
+        else:
+            p_win, e_diff, ratings = prediction
         win = round(p_win * 100)
 
         classes1 = ['win' if win > 50 else 'loss']
@@ -96,14 +104,14 @@ class MatchCard(object):
         self.rows = [
             f"""<tr scope="row" class="{' '.join(classes1)}">
   <th class="text-right compact">{render_team_logo(teams[0])}</th>
-  <td>{render_team_link(predictor, teams[0])}</td>
+  <td>{render_team_link(teams[0], ratings[0])}</td>
   <td class="d-none d-sm-table-cell">{score1}</td>
   {render_chance_cell(p_win)}
   <td class="text-center">{e_diff:+.1f}</td>
 </tr>""",
             f"""<tr scope="row" class="{' '.join(classes2)}">
   <th class="text-right compact">{render_team_logo(teams[1])}</th>
-  <td>{render_team_link(predictor, teams[1])}</td>
+  <td>{render_team_link(teams[1], ratings[1])}</td>
   <td class="d-none d-sm-table-cell">{score2}</td>
   {render_chance_cell(1 - p_win)}
   <td class="text-center">{-e_diff:+.1f}</td>
@@ -183,9 +191,8 @@ def render_team_logo(team, width=30) -> str:
     return f'<img src="imgs/{name}.png" alt="{name} Logo" width="{width}">'
 
 
-def render_team_link(predictor, team) -> str:
+def render_team_link(team, rating) -> str:
     name = TEAM_NAMES[team]
-    rating = predictor.ratings[team]
     title = f'{round(rating.mu)} ± {round(rating.sigma * RATING_CONFIDENCE)}'
 
     return f'<a href="/{name}" class="team" data-toggle="tooltip" data-placement="right" title="{title}">{name}</a>'
@@ -271,10 +278,12 @@ def render_page(endpoint: str, title: str, content: str) -> None:
         print(html, file=file)
 
 
-def render_index(predictor, future_games) -> None:
+def render_index(predictor, future_games, precision=None, seed=None,
+                 workers=1) -> None:
     content = ''
 
-    p_stage = predictor.predict_stage(future_games)
+    p_stage = predictor.predict_stage(future_games, precision=precision,
+                                      seed=seed, workers=workers)
     wins = predictor.stage_wins
     losses = predictor.stage_losses
     map_diffs = predictor.stage_map_diffs
@@ -301,7 +310,7 @@ def render_index(predictor, future_games) -> None:
 
         rows.append(f"""<tr scope="row" class="{' '.join(classes)}">
   <th class="text-right">{render_team_logo(team)}</th>
-  <td>{render_team_link(predictor, team)}</td>
+  <td>{render_team_link(team, predictor.ratings[team])}</td>
   <td class="text-center">{win}</td>
   <td class="text-center d-none d-sm-table-cell">{loss}</td>
   <td class="text-center d-none d-sm-table-cell">{map_diff:+}</td>
@@ -334,14 +343,20 @@ def render_index(predictor, future_games) -> None:
     render_page('index', title, content)
 
 
-def render_match_cards(past_games, future_games, day_limit=2):
+def render_match_cards(predictor, past_games, future_games, day_limit=2,
+                       predictions=None):
+    """Render the cards of past matches from the given predictions (e.g.
+    from journal_match_predictions) or the ones recorded by the
+    MatchPredictions observer of the predictor, and the cards of upcoming
+    matches from the predictor itself."""
     # Only predict the upcoming matches.
     if len(future_games) > 0:
         first_date = without_time(future_games[0].start_time)
         future_games = [game for game in future_games
                         if (game.start_time - first_date).days < day_limit]
 
-    predictor = PlayerTrueSkillPredictor()
+    if predictions is None:
+        predictions = predictor.observer(MatchPredictions).predictions
     past_matches = defaultdict(list)
 
     for game in past_games:
@@ -368,8 +383,8 @@ def render_match_cards(past_games, future_games, day_limit=2):
                                      stage=stage,
                                      start_time=start_time,
                                      teams=teams,
-                                     score=score))
-        predictor.train_games(games)
+                                     score=score,
+                                     prediction=predictions[match_id]))
 
     for game in future_games:
         match_cards.append(MatchCard(predictor=predictor,
@@ -656,16 +671,30 @@ def render_about():
     render_page('about', f'About', content)
 
 
-def render_all():
-    past_games, future_games = load_games()
+def render_all(precision=None, seed=None, workers=1, day_limit=2):
+    past_games, _ = load_games()
 
-    predictor = PlayerTrueSkillPredictor()
-    predictor.train_games(past_games)
+    # Record everything needed for rendering in a single pass.
+    observers = PlayerTrueSkillPredictor.default_observers()
+    observers.append(MatchPredictions())
+    predictor = train_predictor(past_games, observers=observers)
     predictor.save_ratings_history()
 
-    match_cards = render_match_cards(past_games, future_games)
-
-    render_index(predictor, future_games)
+    # Only load the upcoming matches & the rest of the stage.
+    upcoming_games = []
+    next_game = next(iter_games(played=False), None)
+    if next_game is not None:
+        first_date = without_time(next_game.start_time)
+        upcoming_games = list(iter_games(
+            played=False, start=first_date,
+            end=first_date + timedelta(days=day_limit)))
+    stage_games = list(iter_games(stage=predictor.stage, played=False))
+
+    match_cards = render_match_cards(predictor, past_games, upcoming_games,
+                                     day_limit=day_limit)
+
+    render_index(predictor, stage_games, precision=precision, seed=seed,
+                 workers=workers)
     render_matches(match_cards)
     render_teams(predictor, match_cards)
     render_about()
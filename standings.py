@@ -0,0 +1,223 @@
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class TeamIds(object):
+    """Intern team names to dense integer ids, in order of appearance."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.teams = []
+        self._ids = {}
+
+    def __len__(self) -> int:
+        return len(self.teams)
+
+    def __contains__(self, team: str) -> bool:
+        return team in self._ids
+
+    def __getitem__(self, team: str) -> int:
+        """Return the id of the team, interning it if needed."""
+        team_id = self._ids.get(team)
+        if team_id is None:
+            team_id = self._ids[team] = len(self.teams)
+            self.teams.append(team)
+        return team_id
+
+    def get(self, team: str) -> Optional[int]:
+        return self._ids.get(team)
+
+    def ids(self, teams: Sequence[str]) -> np.ndarray:
+        return np.array([self[team] for team in teams], dtype=np.int64)
+
+
+class Standings(object):
+    """Counters of teams kept in NumPy arrays indexed by team ids: a vector
+    per counter of single teams and a (teams, teams) matrix per counter of
+    team pairs. Snapshots are read-only views of the arrays, which are only
+    copied when they are updated after a snapshot."""
+
+    def __init__(self, team_ids: TeamIds, vectors: Sequence[str],
+                 matrices: Sequence[str] = ()) -> None:
+        super().__init__()
+
+        self.team_ids = team_ids
+        self.vector_names = tuple(vectors)
+        self.matrix_names = tuple(matrices)
+
+        self._capacity = 0
+        self._shared = False
+        self._vectors = {}
+        self._matrices = {}
+        self.clear()
+
+    def clear(self, *names: str) -> None:
+        """Reset the given counters, or all of them, to 0."""
+        capacity = self._capacity
+
+        for name in names or self.vector_names + self.matrix_names:
+            if name in self.vector_names:
+                self._vectors[name] = np.zeros(capacity, dtype=np.int64)
+            else:
+                self._matrices[name] = np.zeros((capacity, capacity),
+                                                dtype=np.int64)
+
+        if not names:
+            self._shared = False
+
+    def get(self, name: str, team: str) -> int:
+        team_id = self.team_ids.get(team)
+        if team_id is None or team_id >= self._capacity:
+            return 0
+        return int(self._vectors[name][team_id])
+
+    def get_pair(self, name: str, team1: str, team2: str) -> int:
+        id1 = self.team_ids.get(team1)
+        id2 = self.team_ids.get(team2)
+        if id1 is None or id2 is None or max(id1, id2) >= self._capacity:
+            return 0
+        return int(self._matrices[name][id1, id2])
+
+    def add(self, name: str, team: str, value: int = 1) -> None:
+        team_id = self.team_ids[team]
+        self._prepare_update(team_id)
+        self._vectors[name][team_id] += value
+
+    def add_pair(self, name: str, team1: str, team2: str,
+                 value: int = 1) -> None:
+        id1 = self.team_ids[team1]
+        id2 = self.team_ids[team2]
+        self._prepare_update(max(id1, id2))
+        self._matrices[name][id1, id2] += value
+
+    def set(self, name: str, team: str, value: int) -> None:
+        self.add(name, team, value - self.get(name, team))
+
+    def set_pair(self, name: str, team1: str, team2: str,
+                 value: int) -> None:
+        self.add_pair(name, team1, team2,
+                      value - self.get_pair(name, team1, team2))
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Return read-only views of all the counters of the teams interned
+        so far, in O(1)."""
+        n_teams = len(self.team_ids)
+        if n_teams > self._capacity:
+            self._grow(n_teams)
+
+        snapshot = {name: vector[:n_teams]
+                    for name, vector in self._vectors.items()}
+        snapshot.update((name, matrix[:n_teams, :n_teams])
+                        for name, matrix in self._matrices.items())
+        for array in snapshot.values():
+            array.flags.writeable = False
+
+        self._shared = True
+        return snapshot
+
+    def vector(self, name: str, teams: Sequence[str]) -> np.ndarray:
+        """Return the counters of the given teams."""
+        # Intern the teams first, so the snapshot covers them.
+        ids = self.team_ids.ids(teams)
+        return self.snapshot()[name][ids]
+
+    def matrix(self, name: str, teams: Sequence[str]) -> np.ndarray:
+        """Return the (teams, teams) counters of pairs of the given teams."""
+        ids = self.team_ids.ids(teams)
+        return self.snapshot()[name][np.ix_(ids, ids)]
+
+    def view(self, name: str) -> 'TeamCounter':
+        return TeamCounter(self, name)
+
+    def pair_view(self, name: str) -> 'PairCounter':
+        return PairCounter(self, name)
+
+    def _prepare_update(self, team_id: int) -> None:
+        if team_id >= self._capacity:
+            self._grow(team_id + 1)
+        elif self._shared:
+            # Leave the arrays of snapshots untouched.
+            self._vectors = {name: vector.copy()
+                             for name, vector in self._vectors.items()}
+            self._matrices = {name: matrix.copy()
+                              for name, matrix in self._matrices.items()}
+            self._shared = False
+
+    def _grow(self, n_teams: int) -> None:
+        capacity = max(n_teams, 2 * self._capacity, 16)
+        n = self._capacity
+
+        for name, vector in self._vectors.items():
+            self._vectors[name] = np.zeros(capacity, dtype=np.int64)
+            self._vectors[name][:n] = vector
+        for name, matrix in self._matrices.items():
+            self._matrices[name] = np.zeros((capacity, capacity),
+                                            dtype=np.int64)
+            self._matrices[name][:n, :n] = matrix
+
+        self._capacity = capacity
+        self._shared = False
+
+
+class TeamCounter(MutableMapping):
+    """Dict-style view of a counter of single teams. Like a defaultdict(int),
+    unknown teams count 0."""
+
+    def __init__(self, standings: Standings, name: str) -> None:
+        super().__init__()
+        self.standings = standings
+        self.name = name
+
+    def __getitem__(self, team: str) -> int:
+        return self.standings.get(self.name, team)
+
+    def __setitem__(self, team: str, value: int) -> None:
+        self.standings.set(self.name, team, value)
+
+    def __delitem__(self, team: str) -> None:
+        self.standings.set(self.name, team, 0)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.standings.team_ids.teams))
+
+    def __len__(self) -> int:
+        return len(self.standings.team_ids)
+
+    def clear(self) -> None:
+        self.standings.clear(self.name)
+
+
+class PairCounter(MutableMapping):
+    """Dict-style view of a counter of team pairs, keyed by (team1, team2).
+    Only pairs with a non zero count are iterated."""
+
+    def __init__(self, standings: Standings, name: str) -> None:
+        super().__init__()
+        self.standings = standings
+        self.name = name
+
+    def __getitem__(self, teams: Tuple[str, str]) -> int:
+        return self.standings.get_pair(self.name, *teams)
+
+    def __setitem__(self, teams: Tuple[str, str], value: int) -> None:
+        self.standings.set_pair(self.name, *teams, value)
+
+    def __delitem__(self, teams: Tuple[str, str]) -> None:
+        self.standings.set_pair(self.name, *teams, 0)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        return iter(self._pairs())
+
+    def __len__(self) -> int:
+        return len(self._pairs())
+
+    def clear(self) -> None:
+        self.standings.clear(self.name)
+
+    def _pairs(self) -> List[Tuple[str, str]]:
+        teams = self.standings.team_ids.teams
+        matrix = self.standings.snapshot()[self.name]
+        return [(teams[id1], teams[id2])
+                for id1, id2 in zip(*np.nonzero(matrix))]
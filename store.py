@@ -0,0 +1,245 @@
+import json
+import os
+from collections.abc import Sequence
+from csv import reader as csv_reader
+from datetime import datetime, timedelta
+from typing import Collection, Dict, List, Union
+
+import numpy as np
+
+from game import Game
+
+MAGIC = b'OWLGAMES'
+STORE_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+ALIGNMENT = 64
+
+# name => (dtype, number of columns or None)
+COLUMNS = {
+    'match_id': ('<i4', None),
+    'stage': ('<i2', None),
+    'start_time': ('<i8', None),  # Seconds since EPOCH.
+    'teams': ('<i2', 2),
+    'match_format': ('<i2', None),
+    'game_id': ('<i4', None),  # -1 for future games, like below.
+    'game_number': ('<i2', None),
+    'map_name': ('<i2', None),
+    'score': ('<i2', 2),
+    'rosters': ('<i4', 12),  # The players of team1, then of team2.
+}
+# Columns of strings, each interned in a table of names.
+NAME_TABLES = {
+    'stage': 'stages',
+    'teams': 'teams',
+    'match_format': 'formats',
+    'map_name': 'maps',
+    'rosters': 'players'
+}
+
+
+class GameStore(object):
+    """Games kept column by column in a single binary file, which is mapped
+    in memory instead of being read. Strings are interned into tables of
+    names, so columns are all fixed width integers. Games are only built
+    when they are accessed."""
+
+    def __init__(self, filename: str) -> None:
+        super().__init__()
+
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a game store')
+            header_size = int.from_bytes(file.read(8), 'little')
+            header = json.loads(file.read(header_size))
+
+        if header['version'] != STORE_VERSION:
+            raise ValueError(f'Unsupported game store version '
+                             f'{header["version"]}')
+        self.source = header['source']
+        self.names = header['names']
+
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+        self.columns = {}
+        for name, (dtype, shape, offset) in header['columns'].items():
+            n_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            column = data[offset:offset + n_bytes].view(dtype)
+            self.columns[name] = column.reshape(shape)
+
+    def __len__(self) -> int:
+        return len(self.columns['match_id'])
+
+    def game(self, index: int) -> Game:
+        """Build the game of a row."""
+        columns = self.columns
+        names = self.names
+
+        teams = tuple(names['teams'][team_id]
+                      for team_id in columns['teams'][index])
+        game = Game(
+            match_id=int(columns['match_id'][index]),
+            stage=names['stages'][columns['stage'][index]],
+            start_time=EPOCH + timedelta(
+                seconds=int(columns['start_time'][index])),
+            teams=teams,
+            match_format=names['formats'][columns['match_format'][index]])
+
+        if columns['game_id'][index] < 0:
+            return game
+
+        players = [names['players'][player_id]
+                   for player_id in columns['rosters'][index]]
+        return game._replace(
+            game_id=int(columns['game_id'][index]),
+            game_number=int(columns['game_number'][index]),
+            map_name=names['maps'][columns['map_name'][index]],
+            score=tuple(int(score) for score in columns['score'][index]),
+            rosters=(tuple(players[:6]), tuple(players[6:])))
+
+    def select(self, stage: str = None, start: datetime = None,
+               end: datetime = None, match_ids: Collection[int] = None,
+               played: bool = None) -> np.ndarray:
+        """Return the rows, in order, of the games matching all the given
+        filters, see fetcher.iter_games."""
+        columns = self.columns
+        mask = np.ones(len(self), dtype=bool)
+
+        if played is not None:
+            mask &= (columns['game_id'] >= 0) == played
+        if stage is not None:
+            if stage in self.names['stages']:
+                mask &= columns['stage'] == self.names['stages'].index(stage)
+            else:
+                mask[:] = False
+        if start is not None:
+            mask &= columns['start_time'] >= _seconds(start)
+        if end is not None:
+            mask &= columns['start_time'] < _seconds(end)
+        if match_ids is not None:
+            mask &= np.isin(columns['match_id'],
+                            np.fromiter(match_ids, dtype=np.int64))
+
+        return np.flatnonzero(mask)
+
+    def games(self, played: bool) -> 'GameColumns':
+        """Return the past games, or the future ones."""
+        return GameColumns(self, self.select(played=played))
+
+
+class GameColumns(Sequence):
+    """Sequence of games of some rows of a game store, built on access."""
+
+    def __init__(self, store: GameStore, indices: np.ndarray) -> None:
+        super().__init__()
+        self.store = store
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index: Union[int, slice]
+                    ) -> Union[Game, 'GameColumns']:
+        if isinstance(index, slice):
+            return GameColumns(self.store, self.indices[index])
+        return self.store.game(self.indices[index])
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+def csv_signature(csv_filename: str) -> List[int]:
+    """Identify the version of a CSV file by its size & modification time."""
+    stat = os.stat(csv_filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_store(csv_filename: str, store_filename: str) -> GameStore:
+    """Convert a CSV file of games into a game store."""
+    source = csv_signature(csv_filename)
+    tables = {table: {} for table in NAME_TABLES.values()}
+
+    def intern(table: str, name: str) -> int:
+        ids = tables[table]
+        return ids.setdefault(name, len(ids))
+
+    with open(csv_filename, newline='') as csv_file:
+        rows = list(csv_reader(csv_file))[1:]  # Skip the header line.
+
+    columns = {name: np.full((len(rows), n) if n else len(rows), -1,
+                             dtype=dtype)
+               for name, (dtype, n) in COLUMNS.items()}
+
+    for i, row in enumerate(rows):
+        start_time = datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S')
+
+        columns['match_id'][i] = int(row[0])
+        columns['stage'][i] = intern('stages', row[1])
+        columns['start_time'][i] = _seconds(start_time)
+        columns['teams'][i] = (intern('teams', row[3]),
+                               intern('teams', row[4]))
+        columns['match_format'][i] = intern('formats', row[5])
+
+        if row[6]:
+            columns['game_id'][i] = int(row[6])
+            columns['game_number'][i] = int(row[7])
+            columns['map_name'][i] = intern('maps', row[8])
+            columns['score'][i] = (int(row[9]), int(row[10]))
+            columns['rosters'][i] = [intern('players', name)
+                                     for name in row[11:23]]
+
+    names = {table: list(ids) for table, ids in tables.items()}
+    _write_store(columns, names, source, store_filename)
+    return GameStore(store_filename)
+
+
+def open_store(csv_filename: str, store_filename: str) -> GameStore:
+    """Return the game store of a CSV file, built again if the CSV file
+    changed since."""
+    store = None
+    if os.path.exists(store_filename):
+        try:
+            store = GameStore(store_filename)
+        except ValueError:
+            pass
+
+    if store is None or store.source != csv_signature(csv_filename):
+        store = build_store(csv_filename, store_filename)
+    return store
+
+
+def _write_store(columns: Dict[str, np.ndarray], names: Dict[str, List[str]],
+                 source: List[int], store_filename: str) -> None:
+    # Place the columns past the header, aligned.
+    layout = {}
+    header = None
+    header_size = 0
+    while True:
+        offset = _align(len(MAGIC) + 8 + header_size)
+        for name, column in columns.items():
+            layout[name] = (column.dtype.str, column.shape, offset)
+            offset = _align(offset + column.nbytes)
+
+        header = json.dumps({'version': STORE_VERSION, 'source': source,
+                             'names': names, 'columns': layout}).encode()
+        if len(header) <= header_size:
+            break
+        header_size = len(header)
+    header = header.ljust(header_size)
+
+    with open(store_filename + '.tmp', 'wb') as file:
+        file.write(MAGIC)
+        file.write(header_size.to_bytes(8, 'little'))
+        file.write(header)
+        for name, column in columns.items():
+            file.seek(layout[name][2])
+            file.write(np.ascontiguousarray(column).tobytes())
+    os.replace(store_filename + '.tmp', store_filename)
+
+
+def _seconds(time: datetime) -> int:
+    return (time - EPOCH) // timedelta(seconds=1)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules of the repository are top-level, import them from its root.
+sys.path.insert(0, ROOT)
+
+from fetcher import load_availabilities  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def availabilities():
+    """The availabilities of the repository, whatever the working
+    directory."""
+    return load_availabilities(os.path.join(ROOT, 'availabilities.csv'))
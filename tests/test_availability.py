@@ -0,0 +1,68 @@
+import os
+from collections import defaultdict
+from csv import DictReader
+from itertools import islice
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def rows():
+    """The players available to every team, by (stage, match number), read
+    from the csv file."""
+    rows = {}
+    with open(os.path.join(ROOT, 'availabilities.csv'), newline='') as file:
+        for row in DictReader(file):
+            key = (row.pop('stage'), int(row.pop('match_number')))
+            team_members = defaultdict(set)
+            for name, team in row.items():
+                if team:
+                    team_members[team].add(name)
+            rows[key] = team_members
+    return rows
+
+
+def test_availabilities_mapping(availabilities, rows):
+    assert dict(availabilities) == rows
+
+    for stage in {stage for stage, _ in rows}:
+        teams = {team for (row_stage, _), team_members in rows.items()
+                 if row_stage == stage for team in team_members}
+        assert availabilities.stage_teams(stage) == teams
+    assert availabilities.stage_teams('Stage 5') == frozenset()
+
+
+def test_availabilities_masks(availabilities, rows):
+    for (stage, match_number), team_members in rows.items():
+        for team, members in team_members.items():
+            mask = availabilities.mask(stage, match_number, team)
+
+            assert set(availabilities.players(mask)) == members
+            assert mask == availabilities.roster_mask(sorted(members))
+
+            # Rosters of the members are available, not with an outsider.
+            roster = sorted(members)[:6]
+            assert availabilities.available(roster, mask)
+            outsider = next(name for other, other_members
+                            in team_members.items() if other != team
+                            for name in other_members)
+            assert not availabilities.available(roster[:5] + [outsider],
+                                                mask)
+
+        assert availabilities.mask(stage, match_number, 'XYZ') == 0
+
+    with pytest.raises(KeyError):
+        availabilities.mask('Stage 5', 1, 'BOS')
+
+
+def test_availabilities_players_in_id_order(availabilities, rows):
+    team_members = rows[next(iter(rows))]
+    for members in islice(team_members.values(), 3):
+        mask = availabilities.roster_mask(members)
+        players = availabilities.players(mask)
+
+        ids = [availabilities.player_ids[name] for name in players]
+        assert ids == sorted(ids)
+        assert availabilities.roster_mask(players) == mask
@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Dict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from client import APIClient, decode_page
+from fetcher import fetch_games, save_games, sync_games
+
+
+class FakeAPI(object):
+    """Pages of matches and single matches of the API. Error responses to
+    send before the actual ones are queued by path, and the body of the
+    held page is only sent in full once released."""
+
+    def __init__(self, n_matches: int) -> None:
+        super().__init__()
+
+        self.matches = [{'id': i, 'name': f'match {i}'}
+                        for i in range(n_matches)]
+        self.errors = defaultdict(list)
+        self.requests = []
+        self.held_page = None
+        self.release = threading.Event()
+        self.url = None
+
+    def page(self, page: int, size: int) -> bytes:
+        content = self.matches[page * size:(page + 1) * size]
+        last = (page + 1) * size >= len(self.matches)
+        return json.dumps({'content': content, 'number': page,
+                           'last': last}).encode()
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        api = self.server.api
+        url = urlparse(self.path)
+        path = url.path.lstrip('/')
+        query = parse_qs(url.query)
+        page = int(query['page'][0]) if 'page' in query else None
+
+        if api.errors[path]:
+            status, headers = api.errors[path].pop(0)
+            api.requests.append((path, page, status, time.monotonic()))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if path == 'matches':
+            body = api.page(page, int(query['size'][0]))
+        else:
+            body = json.dumps(api.matches[int(path.split('/')[1])]).encode()
+
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            api.requests.append((path, page, 304, time.monotonic()))
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        api.requests.append((path, page, 200, time.monotonic()))
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        chunks = [body]
+        if page is not None and page == api.held_page:
+            chunks = [body[:len(body) // 2], body[len(body) // 2:]]
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                api.release.wait(5.0)
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+@pytest.fixture
+def api():
+    api = FakeAPI(12)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPIHandler)
+    server.api = api
+    api.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.01},
+                              daemon=True)
+    thread.start()
+
+    yield api
+
+    api.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_pages(api: FakeAPI, pages=None, page_size: int = 5,
+                on_match=None):
+    async def fetch():
+        raw_matches = []
+        with APIClient(api.url) as client:
+            async for raw_match in client.fetch_pages(page_size, pages):
+                raw_matches.append(raw_match)
+                if on_match is not None:
+                    on_match(raw_match)
+        return raw_matches
+
+    return asyncio.run(fetch())
+
+
+def statuses(api: FakeAPI, path: str):
+    return [status for request_path, _, status, _ in api.requests
+            if request_path == path]
+
+
+def test_get_retries_transient_statuses(api):
+    api.errors['matches/3'] = [(503, {}), (429, {}), (500, {})]
+
+    with APIClient(api.url, backoff=0.01) as client:
+        raw_match = asyncio.run(client.get_json('matches/3'))
+
+    assert raw_match == api.matches[3]
+    assert statuses(api, 'matches/3') == [503, 429, 500, 200]
+
+
+def test_get_returns_other_statuses(api):
+    api.errors['matches/3'] = [(404, {})]
+
+    with APIClient(api.url, backoff=0.01) as client:
+        response = asyncio.run(client.get('matches/3'))
+
+    assert response.status_code == 404
+    assert statuses(api, 'matches/3') == [404]
+
+
+def test_get_waits_retry_after(api):
+    api.errors['matches/3'] = [(503, {'Retry-After': '1'})]
+
+    with APIClient(api.url, backoff=0.01) as client:
+        asyncio.run(client.get_json('matches/3'))
+
+    (_, _, _, failed), (_, _, _, retried) = api.requests
+    assert retried - failed >= 1.0
+
+
+def test_get_gives_up_after_retries(api):
+    api.errors['matches/3'] = [(502, {})] * 3
+
+    with APIClient(api.url, retries=2, backoff=0.01) as client:
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(client.get('matches/3'))
+
+    assert statuses(api, 'matches/3') == [502, 502, 502]
+
+
+def test_get_gives_up_at_deadline(api):
+    api.errors['matches/3'] = [(503, {'Retry-After': '5'})]
+
+    with APIClient(api.url, deadline=1.0) as client:
+        start = time.monotonic()
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(client.get('matches/3'))
+
+    # Waiting for the retry would pass the deadline, so it is not waited.
+    assert time.monotonic() - start < 1.0
+    assert statuses(api, 'matches/3') == [503]
+
+
+def test_fetch_pages_conditionally(api):
+    pages = {}
+    raw_matches = fetch_pages(api, pages)
+
+    assert raw_matches == api.matches
+    assert sorted(pages) == ['0', '1', '2']
+    assert [pages[key]['last'] for key in '012'] == [False, False, True]
+    assert pages['1']['match_ids'] == [5, 6, 7, 8, 9]
+
+    # Unmodified pages are skipped.
+    api.requests.clear()
+    assert fetch_pages(api, pages) == []
+    assert statuses(api, 'matches') == [304, 304, 304]
+
+    # Only the modified page is decoded, and its validators updated.
+    etag = pages['1']['etag']
+    api.matches[6]['name'] = 'modified'
+    api.requests.clear()
+    assert fetch_pages(api, pages) == api.matches[5:10]
+    assert sorted(statuses(api, 'matches')) == [200, 304, 304]
+    assert pages['1']['etag'] != etag
+
+    # The pages past the last one are forgotten.
+    del api.matches[7:]
+    assert fetch_pages(api, pages) == api.matches[5:7]
+    assert sorted(pages) == ['0', '1']
+    assert pages['1']['last']
+
+
+def test_fetch_pages_interleaves(api):
+    pages = {str(page): {'etag': None, 'last_modified': None, 'last': False,
+                         'match_ids': []}
+             for page in range(2)}
+    # The second half of page 0 is only sent once a match of page 1 is
+    # yielded, so that happens only if pages are streamed together.
+    api.held_page = 0
+
+    def on_match(raw_match):
+        if raw_match['id'] >= 5:
+            api.release.set()
+
+    raw_matches = fetch_pages(api, pages, on_match=on_match)
+    ids = [raw_match['id'] for raw_match in raw_matches]
+
+    assert sorted(ids) == list(range(12))
+    assert ids.index(5) < ids.index(4)
+    # Matches of a page stay in order.
+    assert [i for i in ids if i < 5] == [0, 1, 2, 3, 4]
+
+
+def test_fetch_matches_cancels_on_error(api):
+    api.errors['matches/0'] = [(404, {})]
+
+    async def fetch():
+        with APIClient(api.url, match_concurrency=1) as client:
+            with pytest.raises(requests.HTTPError):
+                async for _ in client.fetch_matches(range(12)):
+                    pass
+            n_requests = len(api.requests)
+            await asyncio.sleep(0.2)
+        return n_requests
+
+    # The matches waiting for the semaphore are not requested, while the
+    # loop keeps running.
+    n_requests = asyncio.run(fetch())
+    assert len(api.requests) <= n_requests + 1
+
+
+def raw_match(match_id: int) -> Dict:
+    """A concluded match of the API, with a single game."""
+    teams = [{'id': 1, 'abbreviatedName': 'BOS'},
+             {'id': 2, 'abbreviatedName': 'NYE'}]
+    players = [{'team': {'id': team['id']},
+                'player': {'name': f"{team['abbreviatedName']}{i}"}}
+               for team in teams for i in range(6)]
+    return {'id': match_id, 'state': 'CONCLUDED',
+            'startDate': 1550000000000 + 3600000 * match_id,
+            'bracket': {'stage': {'title': 'Stage 1'}},
+            'competitors': teams,
+            'games': [{'id': 100 * match_id, 'number': 1,
+                       'state': 'CONCLUDED',
+                       'attributes': {'map': 'nepal'},
+                       'points': [1, 0], 'players': players}]}
+
+
+def test_sync_games_incrementally(api, tmp_path):
+    api.matches = [raw_match(i) for i in range(12)]
+    csv_filename = str(tmp_path / 'games.csv')
+    state_filename = str(tmp_path / 'sync.json')
+
+    def sync():
+        with APIClient(api.url) as client:
+            return sync_games(csv_filename, state_filename, page_size=5,
+                              raw_dir=str(tmp_path / 'raw'), client=client)
+
+    def fetched():
+        full_filename = str(tmp_path / 'full.csv')
+        with APIClient(api.url) as client:
+            save_games(fetch_games(page_size=5, client=client),
+                       full_filename)
+        with open(full_filename) as file:
+            return file.read()
+
+    assert sync() == 12
+    with open(csv_filename) as file:
+        assert file.read() == fetched()
+
+    # Only the changed match is parsed & merged again.
+    api.matches[6]['games'][0]['points'] = [0, 1]
+    assert sync() == 1
+    with open(csv_filename) as file:
+        assert file.read() == fetched()
+
+    api.requests.clear()
+    assert sync() == 0
+    assert statuses(api, 'matches') == [304, 304, 304]
+    with open(csv_filename) as file:
+        assert file.read() == fetched()
+
+
+PAGE_BODY = json.dumps({
+    'number': 12345,
+    'ratio': -2.5e-05,
+    'content': [
+        {'id': 1, 'name': 'Séoul Dynasty 東京', 'score': -1.5e+300,
+         'small': 1e-07},
+        {'id': 23456, 'name': 'quote " and \\ backslash', 'tags': []},
+        {'id': 3, 'emoji': '🏆', 'ratio': 0.125, 'done': True, 'x': None},
+        1.5e+300, 0.75, 'Zürich',
+    ],
+    'last': False,
+    'title': 'Überseite',
+}, ensure_ascii=False, indent=1).encode()
+
+
+def test_decode_page_every_split():
+    expected = json.loads(PAGE_BODY)
+    content = expected.pop('content')
+
+    # One byte at a time, then in two chunks split at every offset, so
+    # inside multibyte characters, numbers and strings too.
+    splits = [[PAGE_BODY[i:i + 1] for i in range(len(PAGE_BODY))]]
+    splits += [[PAGE_BODY[:i], PAGE_BODY[i:]]
+               for i in range(len(PAGE_BODY) + 1)]
+    for chunks in splits:
+        fields = {}
+        assert list(decode_page(chunks, fields)) == content
+        assert fields == expected
+
+
+def test_decode_page_truncated():
+    for i in range(len(PAGE_BODY)):
+        with pytest.raises(ValueError):
+            list(decode_page([PAGE_BODY[:i]], {}))
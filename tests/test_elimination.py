@@ -0,0 +1,63 @@
+import random
+from itertools import product
+
+import numpy as np
+
+from elimination import decided_teams, MAX_MAP_DIFF, MIN_MAP_DIFF
+
+# Every map diff of a match, from the first team's point of view.
+MAP_DIFFS = [diff for diff in range(-MAX_MAP_DIFF, MAX_MAP_DIFF + 1)
+             if abs(diff) >= MIN_MAP_DIFF]
+
+
+def enumerated_standings(wins, map_diffs, games):
+    """Return the (outcomes, teams) wins & map diffs of every outcome of the
+    games."""
+    outcomes = np.array(list(product(MAP_DIFFS, repeat=len(games))),
+                        dtype=np.int64)
+    outcomes = outcomes.reshape(len(MAP_DIFFS)**len(games), len(games))
+    all_wins = np.tile(np.array(wins), (len(outcomes), 1))
+    all_map_diffs = np.tile(np.array(map_diffs), (len(outcomes), 1))
+
+    for i, (team1, team2) in enumerate(games):
+        diffs = outcomes[:, i]
+        all_wins[:, team1] += diffs > 0
+        all_wins[:, team2] += diffs < 0
+        all_map_diffs[:, team1] += diffs
+        all_map_diffs[:, team2] -= diffs
+
+    return all_wins, all_map_diffs
+
+
+def test_decided_teams_against_enumeration():
+    rng = random.Random(0)
+
+    for _ in range(400):
+        n_teams = rng.randint(4, 6)
+        wins = [rng.randint(0, 4) for _ in range(n_teams)]
+        map_diffs = [rng.randint(-6, 6) for _ in range(n_teams)]
+        games = [tuple(rng.sample(range(n_teams), 2))
+                 for _ in range(rng.randint(0, 4))]
+
+        clinched, eliminated = decided_teams(wins, map_diffs, games)
+        all_wins, all_map_diffs = enumerated_standings(wins, map_diffs,
+                                                       games)
+
+        for team in range(n_teams):
+            team_wins = all_wins[:, [team]]
+            team_map_diffs = all_map_diffs[:, [team]]
+            above = ((all_wins > team_wins) |
+                     ((all_wins == team_wins) &
+                      (all_map_diffs > team_map_diffs))).sum(axis=1)
+            # The team itself is tied with itself.
+            above_or_tied = ((all_wins > team_wins) |
+                             ((all_wins == team_wins) &
+                              (all_map_diffs >= team_map_diffs))
+                             ).sum(axis=1) - 1
+
+            # Ties may be broken either way, a decided team is certain.
+            if team in eliminated:
+                assert (above >= 3).all(), (wins, map_diffs, games, team)
+            if team in clinched:
+                assert (above_or_tied < 3).all(), (wins, map_diffs, games,
+                                                   team)
@@ -0,0 +1,135 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from cache import RawCache
+from fetcher import (export_database, iter_games, load_availabilities,
+                     load_games, reparse_games)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_load_games_unwritable_store(tmp_path):
+    csv_filename = str(tmp_path / 'games.csv')
+    with open(os.path.join(ROOT, 'games.csv')) as file:
+        lines = file.readlines()
+    with open(csv_filename, 'w') as file:
+        file.writelines(lines[:100] + lines[-10:])
+    # Its directory does not exist, so the store can't be written.
+    store_filename = str(tmp_path / 'read-only' / 'games.bin')
+
+    past_games, future_games = load_games(csv_filename, store_filename)
+    csv_past_games, csv_future_games = load_games(csv_filename, None)
+
+    assert list(past_games) == csv_past_games
+    assert list(future_games) == csv_future_games
+    assert (list(iter_games(csv_filename, store_filename)) ==
+            list(iter_games(csv_filename, None)))
+    assert not os.path.exists(store_filename)
+
+
+def _raw_match(match_id):
+    return {'id': match_id, 'state': 'PENDING', 'games': [],
+            'startDate': 1550000000000 + match_id,
+            'bracket': {'stage': {'title': 'Stage 1'}},
+            'competitors': [{'id': 1, 'abbreviatedName': 'BOS'},
+                            {'id': 2, 'abbreviatedName': 'NYE'}]}
+
+
+def test_reparse_games_expired_entries(tmp_path):
+    raw_dir = str(tmp_path / 'raw')
+    csv_filename = str(tmp_path / 'games.csv')
+    state_filename = str(tmp_path / 'sync.json')
+
+    cache = RawCache(raw_dir)
+    cache.put(1, _raw_match(1))
+    cache.put(2, _raw_match(2))
+    cache.save()
+    with open(state_filename, 'w') as state_file:
+        json.dump({'pages': {}, 'matches': {'1': 'a', '2': 'b'}},
+                  state_file)
+
+    # Backdate an entry past the ttl, reparsing still keeps its games.
+    with open(os.path.join(raw_dir, 'index.json')) as index_file:
+        index = json.load(index_file)
+    index['1'][1] -= 60 * 24 * 3600
+    with open(os.path.join(raw_dir, 'index.json'), 'w') as index_file:
+        json.dump(index, index_file)
+
+    assert reparse_games(csv_filename, raw_dir, state_filename) == 2
+    with open(csv_filename) as file:
+        assert len(file.readlines()) == 3
+
+    # Once evicted, the cache misses a synced match & the file is kept.
+    RawCache(raw_dir).save()
+    with pytest.raises(ValueError):
+        reparse_games(csv_filename, raw_dir, state_filename)
+    with open(csv_filename) as file:
+        assert len(file.readlines()) == 3
+
+
+def test_database_round_trip(tmp_path):
+    database = str(tmp_path / 'owl.db')
+    csv_filename = os.path.join(ROOT, 'games.csv')
+    availabilities_filename = os.path.join(ROOT, 'availabilities.csv')
+    export_database(database, csv_filename, availabilities_filename)
+
+    assert (load_games(database=database) ==
+            load_games(csv_filename, store_filename=None))
+    assert (dict(load_availabilities(database=database)) ==
+            dict(load_availabilities(availabilities_filename)))
+    assert (list(iter_games(database=database, stage='Stage 2')) ==
+            list(iter_games(csv_filename, None, stage='Stage 2')))
+
+
+@pytest.fixture(scope='module')
+def sources(tmp_path_factory):
+    """The keyword arguments of iter_games reading the games.csv file from
+    the csv rows, a GameStore and a Database."""
+    tmp_path = tmp_path_factory.mktemp('sources')
+    csv_filename = os.path.join(ROOT, 'games.csv')
+    database = str(tmp_path / 'owl.db')
+    export_database(database, csv_filename,
+                    os.path.join(ROOT, 'availabilities.csv'))
+
+    return [dict(csv_filename=csv_filename, store_filename=None),
+            dict(csv_filename=csv_filename,
+                 store_filename=str(tmp_path / 'games.bin')),
+            dict(database=database)]
+
+
+def test_iter_games_filters(sources):
+    past_games, future_games = load_games(os.path.join(ROOT, 'games.csv'),
+                                          store_filename=None)
+    games = sorted(past_games + future_games,
+                   key=lambda game: (game.start_time, game.match_id))
+    start = datetime(2018, 3, 1)
+    middle = datetime(2018, 3, 10)
+    end = datetime(2018, 5, 1)
+    match_ids = {game.match_id for game in games[::50]}
+
+    cases = [
+        (dict(), lambda game: True),
+        (dict(stage='Stage 2'), lambda game: game.stage == 'Stage 2'),
+        (dict(start=start), lambda game: game.start_time >= start),
+        (dict(end=end), lambda game: game.start_time < end),
+        (dict(start=start, end=end),
+         lambda game: start <= game.start_time < end),
+        (dict(match_ids=match_ids), lambda game: game.match_id in match_ids),
+        (dict(played=True), lambda game: game.score is not None),
+        (dict(played=False), lambda game: game.score is None),
+        (dict(stage='Stage 2', played=True, end=middle),
+         lambda game: (game.stage == 'Stage 2' and
+                       game.score is not None and game.start_time < middle)),
+        (dict(stage='Stage 1', start=end), lambda game: False),
+        (dict(match_ids=match_ids, played=False, start=start),
+         lambda game: (game.match_id in match_ids and
+                       game.score is None and game.start_time >= start)),
+    ]
+    for filters, predicate in cases:
+        expected = [game for game in games if predicate(game)]
+        for source in sources:
+            assert list(iter_games(**source, **filters)) == expected, \
+                (filters, source)
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from fetcher import load_games
+from journal import (journal_evaluation, journal_match_predictions,
+                     PredictionJournal)
+from observers import Evaluation, MatchPredictions
+from predictor import predictor_config, TrueSkillPredictor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TITLE_MATCH_ID = 10537
+
+
+def test_journal_title_match_prediction(tmp_path, availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    end = max(i for i, game in enumerate(games)
+              if game.match_id == TITLE_MATCH_ID) + 1
+    assert games[end - 1].match_format == 'title'
+
+    config = predictor_config(TrueSkillPredictor)
+    filename = str(tmp_path / 'journal.jsonl')
+    live = MatchPredictions()
+    journal = PredictionJournal(config, filename=filename)
+    predictor = TrueSkillPredictor(
+        availabilities=availabilities,
+        observers=[live, journal])
+    predictor.train_games(games[:end])
+    journal.close()
+
+    journaled = journal_match_predictions(config, filename=filename)
+    assert journaled[TITLE_MATCH_ID] == live.predictions[TITLE_MATCH_ID]
+
+
+def test_journal_evaluation_corrected_result(tmp_path, availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    games = games[:300]
+
+    config = predictor_config(TrueSkillPredictor)
+    filename = str(tmp_path / 'journal.jsonl')
+    evaluation = Evaluation()
+    with PredictionJournal(config, filename=filename) as journal:
+        predictor = TrueSkillPredictor(
+            availabilities=availabilities,
+            observers=[evaluation, journal])
+        predictor.train_games(games)
+    assert journal._file is None
+
+    avg_point, avg_accuracy = journal_evaluation(config, games,
+                                                 filename=filename)
+    assert avg_point == pytest.approx(sum(evaluation.points) / len(games))
+    assert avg_accuracy == pytest.approx(sum(evaluation.corrects) /
+                                         len(games))
+
+    # The predictions after a corrected result are stale.
+    score1, score2 = games[100].score
+    games[100] = games[100]._replace(score=(score2, score1))
+    with pytest.raises(KeyError):
+        journal_evaluation(config, games, filename=filename)
+    assert journal_evaluation(config, games[:100], filename=filename)
@@ -0,0 +1,43 @@
+import itertools
+
+import numpy as np
+
+from lineup import best_lineup, min_rating
+
+
+def brute_force(mu, sigma, size=6):
+    """Return the best min rating of every lineup of size players."""
+    lineups = np.array(list(itertools.combinations(range(len(mu)), size)))
+    return float(min_rating(mu[lineups].sum(axis=1),
+                            np.square(sigma[lineups]).sum(axis=1)).max())
+
+
+def random_roster(rng, n):
+    # Uncertain players are often left out of the lineups of the best mu.
+    return rng.normal(1500.0, 100.0, n), rng.uniform(20.0, 800.0, n)
+
+
+def check_best_lineup(mu, sigma, **kws):
+    lineup, best = best_lineup(mu, sigma, **kws)
+
+    assert len(set(lineup.tolist())) == 6
+    assert np.isclose(best, float(min_rating(mu[lineup].sum(),
+                                             np.square(sigma[lineup]).sum())))
+    assert np.isclose(best, brute_force(mu, sigma))
+
+
+def test_best_lineup_exhaustive():
+    rng = np.random.default_rng(0)
+    for n in (6, 7, 10, 14, 20):
+        for _ in range(5):
+            check_best_lineup(*random_roster(rng, n))
+
+
+def test_best_lineup_branch_and_bound():
+    rng = np.random.default_rng(1)
+    for n in (21, 24):
+        check_best_lineup(*random_roster(rng, n))
+    # Smaller batches prune the lineups of fewer players.
+    for n in (9, 10, 13, 16):
+        for _ in range(5):
+            check_best_lineup(*random_roster(rng, n), max_batch=50)
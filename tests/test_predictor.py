@@ -0,0 +1,279 @@
+import os
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from fetcher import load_games
+from predictor import (bo_match_scores, PlayerTrueSkillPredictor,
+                       train_predictor, TrueSkillPredictor)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Batched & scalar predictions only differ by rounding errors.
+TOLERANCE = dict(rtol=1e-9, atol=1e-15)
+
+
+def test_predict_stage_precision_rejects_workers(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    stage = [game for game in games
+             if game.stage == 'Stage 2' and game.match_format == 'regular']
+    # Leave the last match of the stage to predict.
+    last = stage[-1].match_id
+    past = [game for game in games if game.start_time < stage[-1].start_time
+            and game.match_id != last]
+    future = [game._replace(score=None) for game in stage
+              if game.match_id == last][:1]
+
+    predictor = TrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(past)
+    assert predictor.predict_stage(future, precision=0.01)
+
+    with pytest.raises(ValueError):
+        predictor.predict_stage(future, precision=0.01, workers=2)
+
+
+def test_simulate_stage_keeps_eliminated_teams(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    stage = [game for game in games
+             if game.stage == 'Stage 2' and game.match_format == 'regular']
+    # Leave the last 10 matches of the stage to predict.
+    match_ids = list(dict.fromkeys(game.match_id for game in stage))
+    first = next(game for game in stage if game.match_id == match_ids[-10])
+    past = [game for game in games if game.start_time < first.start_time]
+    future = list({game.match_id: game._replace(score=None)
+                   for game in stage
+                   if game.start_time >= first.start_time}.values())
+
+    predictor = TrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(past)
+    _, eliminated = predictor._decided_teams(future)
+    assert {'BOS', 'SFS'} <= eliminated
+
+    scenarios = predictor.simulate_stage(future, iters=2000, seed=0)
+    # Both teams of match 10581 have been eliminated, BOS plays 10587.
+    prediction, _ = scenarios.what_if({10587: 'BOS', 10581: 'SFS'})
+    assert prediction['BOS'] == (0.0, 0.0)
+    assert set(scenarios.leverage()[10581]) == set(prediction)
+
+
+def test_train_predictor_checkpoint_availabilities(tmp_path,
+                                                   availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    games = games[:300]
+    checkpoint = str(tmp_path / 'predictor.pkl.gz')
+
+    predictor = train_predictor(games, class_=PlayerTrueSkillPredictor,
+                                checkpoint=checkpoint,
+                                availabilities=availabilities)
+
+    # Correct the availability of a player of the last best roster.
+    team = games[-1].teams[0]
+    match_key = (games[-1].stage,
+                 len(predictor.match_history[predictor.stage][team]))
+    removed = predictor.best_rosters[team][0]
+    corrected = {key: {team: set(members)
+                       for team, members in team_members.items()}
+                 for key, team_members in availabilities.items()}
+    corrected[match_key][team].discard(removed)
+
+    predictor = train_predictor(games, class_=PlayerTrueSkillPredictor,
+                                checkpoint=checkpoint,
+                                availabilities=corrected)
+    assert removed not in predictor.best_rosters[team]
+
+
+def test_match_cache_invalidated_by_training(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    predictor = PlayerTrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(games[:200])
+
+    game = games[200]
+    cache = predictor.match_cache
+    misses = cache.misses
+    p_scores = predictor.predict_match_score(game.teams)
+    hits = cache.hits
+    assert predictor.predict_match_score(game.teams) == p_scores
+    assert (cache.hits, cache.misses) == (hits + 1, misses + 1)
+
+    version = predictor.rating_version
+    predictor.train(game)
+    assert predictor.rating_version == version + 1
+
+    # The new ratings are predicted, not the memoized scores.
+    misses = cache.misses
+    uncached = PlayerTrueSkillPredictor(availabilities=availabilities,
+                                        match_cache_size=0)
+    uncached.train_games(games[:201])
+    assert predictor.predict_match_score(game.teams) == \
+        uncached.predict_match_score(game.teams)
+    assert predictor.predict_match_score(game.teams) != p_scores
+    assert cache.misses == misses + 1
+
+
+def test_closed_form_updates_agree_with_trueskill(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    games = games[:600]
+    assert any(game.score[0] == game.score[1] for game in games)
+
+    # Every update is checked against trueskill.rate.
+    predictor = PlayerTrueSkillPredictor(availabilities=availabilities,
+                                         verify_updates=True)
+    predictor.train_games(games)
+
+    # A different draw margin is caught.
+    predictor = PlayerTrueSkillPredictor(availabilities=availabilities,
+                                         verify_updates=True)
+    predictor.draw_margins = {(True, 12): 0.0, (False, 12): 0.0}
+    with pytest.raises(AssertionError):
+        predictor.train_games(games)
+
+
+def test_predict_stage_workers_reproducible(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    stage = [game for game in games
+             if game.stage == 'Stage 2' and game.match_format == 'regular']
+    # Leave the last 6 matches of the stage to predict.
+    match_ids = list(dict.fromkeys(game.match_id for game in stage))
+    first = next(game for game in stage if game.match_id == match_ids[-6])
+    past = [game for game in games if game.start_time < first.start_time]
+    future = list({game.match_id: game._replace(score=None)
+                   for game in stage
+                   if game.start_time >= first.start_time}.values())
+
+    predictor = TrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(past)
+    predictions = [predictor.predict_stage(future, seed=3, workers=2,
+                                           exact_states=0)
+                   for _ in range(2)]
+    assert predictions[0] == predictions[1]
+
+
+def test_match_cache_list_rosters(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    predictor = PlayerTrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(games[:200])
+
+    game = games[200]
+    rosters = [list(roster) for roster in game.rosters]
+    assert (predictor.predict_game(game._replace(rosters=rosters)) ==
+            predictor.predict_both(game.teams, game.rosters))
+    assert (predictor.predict_match(list(game.teams), rosters) ==
+            predictor.predict_match(game.teams, game.rosters))
+    assert (predictor.predict_match_score(game.teams, rosters) ==
+            predictor.predict_match_score(game.teams, game.rosters))
+
+
+@pytest.fixture(scope='module', params=[TrueSkillPredictor,
+                                        PlayerTrueSkillPredictor])
+def trained(request, availabilities):
+    """A predictor trained on the first 400 games, and 40 of the following
+    games."""
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    predictor = request.param(availabilities=availabilities)
+    predictor.train_games(games[:400])
+    return predictor, games[400:800:10]
+
+
+def test_batched_predictions_equal_scalar(trained):
+    predictor, games = trained
+    teams = [game.teams for game in games]
+
+    for rosters in (None, [game.rosters for game in games]):
+        pairs_rosters = rosters or [None] * len(teams)
+        for drawable in (False, True):
+            p_wins, p_draws = predictor.predict_many(teams, rosters,
+                                                     drawable=drawable)
+            expected = np.array([
+                predictor.predict(pair, pair_rosters, drawable=drawable)
+                for pair, pair_rosters in zip(teams, pairs_rosters)])
+            np.testing.assert_allclose(p_wins, expected[:, 0], **TOLERANCE)
+            np.testing.assert_allclose(p_draws, expected[:, 1], **TOLERANCE)
+
+        p_undrawable, p_drawable = predictor.predict_many_both(teams, rosters)
+        expected = np.array([
+            predictor.predict_both(pair, pair_rosters)
+            for pair, pair_rosters in zip(teams, pairs_rosters)])
+        np.testing.assert_allclose(p_undrawable, expected[:, 0], **TOLERANCE)
+        np.testing.assert_allclose(p_drawable, expected[:, 1], **TOLERANCE)
+
+        for match_format in ('regular', 'title'):
+            p_wins, e_diffs = predictor.predict_match_batch(
+                teams, rosters, match_format=match_format)
+            expected = np.array([
+                predictor.predict_match(pair, pair_rosters,
+                                        match_format=match_format)
+                for pair, pair_rosters in zip(teams, pairs_rosters)])
+            np.testing.assert_allclose(p_wins, expected[:, 0], **TOLERANCE)
+            np.testing.assert_allclose(e_diffs, expected[:, 1], **TOLERANCE)
+
+
+def test_batched_match_scores_equal_scalar(trained):
+    predictor, games = trained
+    teams = [game.teams for game in games]
+
+    for match_format in ('regular', 'title'):
+        scores, p_scores = predictor.predict_match_score_batch(
+            teams, match_format=match_format)
+        np.testing.assert_allclose(p_scores.sum(axis=1), 1.0, **TOLERANCE)
+
+        for pair, pair_p_scores in zip(teams, p_scores):
+            expected = predictor.predict_match_score(
+                pair, match_format=match_format)
+            batched = {score: p for score, p in zip(scores,
+                                                    pair_p_scores.tolist())
+                       if p > 0.0}
+            assert set(batched) <= set(expected)
+            np.testing.assert_allclose(
+                [batched.get(score, 0.0) for score in expected],
+                list(expected.values()), **TOLERANCE)
+
+    # Only undrawable or only drawable maps.
+    p_undrawable, p_drawable = predictor.predict_many_both(teams)
+    for drawables in ((False,) * 4, (True,) * 4):
+        scores, p_scores = bo_match_scores(p_undrawable, p_drawable,
+                                           drawables)
+        np.testing.assert_allclose(p_scores.sum(axis=1), 1.0, **TOLERANCE)
+
+        for pair, pair_p_scores in zip(teams, p_scores):
+            expected = predictor._predict_bo_match_score(pair, None,
+                                                         drawables)
+            assert set(expected) <= set(scores)
+            np.testing.assert_allclose(
+                [expected.get(score, 0.0) for score in scores],
+                pair_p_scores, **TOLERANCE)
+
+
+def test_rating_store_equals_rating_dicts(availabilities):
+    games, _ = load_games(os.path.join(ROOT, 'games.csv'),
+                          store_filename=None)
+    games = games[:400]
+    predictor = PlayerTrueSkillPredictor(availabilities=availabilities)
+    predictor.train_games(games)
+
+    # Rate the players like before the store, in a dict of trueskill
+    # Ratings updated by env.rate.
+    ratings = defaultdict(predictor.env_drawable.create_rating)
+    for game in games:
+        score1, score2 = game.score
+        ranks = [int(score1 < score2), int(score2 < score1)]
+        env = (predictor.env_drawable if game.drawable
+               else predictor.env_undrawable)
+        teams_ratings = env.rate([[ratings[name] for name in roster]
+                                  for roster in game.rosters], ranks=ranks)
+        for roster, roster_ratings in zip(game.rosters, teams_ratings):
+            ratings.update(zip(roster, roster_ratings))
+
+    names = sorted(ratings)
+    np.testing.assert_allclose(
+        [[predictor.ratings[name].mu, predictor.ratings[name].sigma]
+         for name in names],
+        [[ratings[name].mu, ratings[name].sigma] for name in names],
+        rtol=1e-9)
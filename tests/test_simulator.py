@@ -0,0 +1,201 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from simulator import StageSimulator, wilson_intervals
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def three_team_simulator(game_cum_weights=((0.5, 1.0), (0.5, 1.0))
+                         ) -> StageSimulator:
+    """A stage with only 3 teams left, as after eliminations, and two
+    remaining games."""
+    p_wins = [[0.5, 0.6, 0.7],
+              [0.4, 0.5, 0.6],
+              [0.3, 0.4, 0.5]]
+    return StageSimulator(
+        teams=['A', 'B', 'C'],
+        wins=[2, 2, 1],
+        map_diffs=[3, 1, 0],
+        head_to_head_map_diffs=np.zeros((3, 3), dtype=int),
+        title_wins=[0, 0, 0],
+        game_teams=np.array([[0, 1], [1, 2]]),
+        game_scores=np.array([[[3, 0], [0, 3]], [[3, 1], [1, 3]]]),
+        game_cum_weights=np.array(game_cum_weights),
+        p_wins_regular=p_wins,
+        p_wins_title=p_wins,
+        match_ids=[1, 2])
+
+
+def test_simulate_three_teams():
+    simulator = three_team_simulator()
+    top3_count, top1_count = simulator.simulate(
+        1000, rng=np.random.default_rng(0))
+
+    # Every team left makes the top 3.
+    assert top3_count.tolist() == [1000, 1000, 1000]
+    assert top1_count.sum() == 1000
+
+
+def test_solve_decided_teams_exactly():
+    # Uneven game probabilities, whose products do not add up to 1 exactly.
+    simulator = three_team_simulator(((0.3, 1.0), (0.3, 1.0)))
+    p_top3, p_top1 = simulator.solve()
+
+    assert p_top3.tolist() == [1.0, 1.0, 1.0]
+    assert np.isclose(p_top1.sum(), 1.0)
+
+
+def test_wilson_intervals_bounds():
+    for iters in (100, 3000, 12345):
+        lower, upper = wilson_intervals(np.array([0, iters]), iters)
+
+        assert lower[0] == 0.0 and upper[1] == 1.0
+        assert 0.0 < upper[0] and lower[1] < 1.0
+
+
+def five_team_simulator(first_weights=(0.2, 0.2, 0.15, 0.15, 0.15, 0.15)
+                        ) -> StageSimulator:
+    """A stage with 5 teams close in the standings and 4 remaining games,
+    each won 3-0 to 0-3 by either team."""
+    p_wins = np.array([[0.5, 0.6, 0.55, 0.7, 0.65],
+                       [0.4, 0.5, 0.45, 0.6, 0.55],
+                       [0.45, 0.55, 0.5, 0.65, 0.6],
+                       [0.3, 0.4, 0.35, 0.5, 0.45],
+                       [0.35, 0.45, 0.4, 0.55, 0.5]])
+    scores = [[3, 0], [3, 1], [3, 2], [2, 3], [1, 3], [0, 3]]
+    weights = np.array([first_weights,
+                        [0.1, 0.2, 0.2, 0.2, 0.2, 0.1],
+                        [0.3, 0.1, 0.1, 0.2, 0.1, 0.2],
+                        [0.15, 0.15, 0.2, 0.2, 0.15, 0.15]])
+    return StageSimulator(
+        teams=['A', 'B', 'C', 'D', 'E'],
+        wins=[4, 3, 3, 3, 2],
+        map_diffs=[2, 3, 1, 1, -2],
+        head_to_head_map_diffs=np.zeros((5, 5), dtype=int),
+        title_wins=[0, 0, 0, 0, 0],
+        game_teams=np.array([[0, 1], [2, 3], [1, 4], [3, 0]]),
+        game_scores=np.array([scores] * 4),
+        game_cum_weights=np.cumsum(weights, axis=1),
+        p_wins_regular=p_wins,
+        p_wins_title=p_wins,
+        match_ids=[1, 2, 3, 4])
+
+
+def test_solve_agrees_with_simulate():
+    simulator = five_team_simulator()
+    p_top3, p_top1 = simulator.solve()
+
+    iters = 200000
+    top3_count, top1_count = simulator.simulate(
+        iters, rng=np.random.default_rng(0))
+    for p, count in ((p_top3, top3_count), (p_top1, top1_count)):
+        errors = np.sqrt(p * (1.0 - p) / iters)
+        assert np.all(np.abs(count / iters - p) <= 4.0 * errors + 1e-12)
+    assert np.isclose(p_top3.sum(), 3.0)
+    assert np.isclose(p_top1.sum(), 1.0)
+
+
+def assert_close(prediction, n_effective, p_top3, p_top1):
+    for team, (top3, top1) in prediction.items():
+        i = 'ABCDE'.index(team)
+        for p, q in ((top3, p_top3[i]), (top1, p_top1[i])):
+            assert abs(p - q) <= 4.0 * np.sqrt(q * (1.0 - q) / n_effective)
+
+
+def test_what_if_results_and_p_wins():
+    scenarios = five_team_simulator().sample_scenarios(
+        100000, rng=np.random.default_rng(0))
+
+    # A wins match 1, its scenarios are filtered.
+    prediction, n_effective = scenarios.what_if({1: 'A'})
+    assert_close(prediction, n_effective,
+                 *five_team_simulator((0.2, 0.2, 0.15, 0, 0, 0)).solve())
+
+    # A wins match 1 with probability 0.8, its scenarios are reweighted.
+    prediction, n_effective = scenarios.what_if(p_wins={1: 0.8})
+    weights = np.array([0.2, 0.2, 0.15, 0.15, 0.15, 0.15])
+    weights[:3] *= 0.8 / 0.55
+    weights[3:] *= 0.2 / 0.45
+    assert_close(prediction, n_effective,
+                 *five_team_simulator(tuple(weights)).solve())
+
+
+def test_what_if_impossible_results():
+    # A always wins match 1.
+    scenarios = five_team_simulator((0.5, 0.5, 0, 0, 0, 0)).sample_scenarios(
+        1000, rng=np.random.default_rng(0))
+
+    with pytest.raises(ValueError):
+        scenarios.what_if({1: 'B'})
+    with pytest.raises(ValueError):
+        scenarios.what_if(p_wins={1: 0.5})
+
+    prediction, n_effective = scenarios.what_if(p_wins={1: 1.0})
+    assert n_effective == 1000
+    assert not np.isnan(list(prediction.values())).any()
+
+
+def test_simulate_parallel_reproducible():
+    simulator = five_team_simulator()
+
+    for reduce_variance in (False, True):
+        counts = [simulator.simulate_parallel(
+                      30000, workers=2, seed=7,
+                      reduce_variance=reduce_variance)
+                  for _ in range(2)]
+        assert np.array_equal(counts[0][0], counts[1][0])
+        assert np.array_equal(counts[0][1], counts[1][1])
+
+        # A single worker simulates as simulate does.
+        top3, top1 = simulator.simulate_parallel(
+            30000, workers=1, seed=7, reduce_variance=reduce_variance)
+        serial_top3, serial_top1 = simulator.simulate(
+            30000, rng=np.random.default_rng(7),
+            reduce_variance=reduce_variance)
+        assert np.array_equal(top3, serial_top3)
+        assert np.array_equal(top1, serial_top1)
+
+
+def test_simulate_against_baseline():
+    # Stage 2 with 30 matches left, and the probabilities of the
+    # per-iteration simulation the batched one replaced, over 1000000
+    # iterations.
+    with open(os.path.join(DATA, 'stage2_simulator.json')) as file:
+        fixture = json.load(file)
+    baseline = fixture.pop('baseline')
+    simulator = StageSimulator(**fixture)
+
+    iters = 200000
+    counts = simulator.simulate(iters, rng=np.random.default_rng(0))
+    for count, p in zip(counts, (baseline['top3'], baseline['top1'])):
+        p = np.array(p)
+        errors = np.sqrt(p * (1.0 - p) * (1.0 / iters +
+                                          1.0 / baseline['iters']))
+        assert np.all(np.abs(count / iters - p) <= 4.0 * errors + 1e-4)
+
+
+def test_estimate_until_fewer_iterations():
+    with open(os.path.join(DATA, 'stage2_simulator.json')) as file:
+        fixture = json.load(file)
+    baseline = fixture.pop('baseline')
+    simulator = StageSimulator(**fixture)
+
+    precision = 0.002
+    _, _, iters = simulator.simulate_until(
+        precision, rng=np.random.default_rng(0))
+    estimate = simulator.estimate_until(precision,
+                                        rng=np.random.default_rng(0))
+    assert estimate.iters * 2.5 <= iters
+    assert max(estimate.top3_errors.max(),
+               estimate.top1_errors.max()) <= precision
+
+    for p, errors, p_baseline in zip(
+            (estimate.top3, estimate.top1),
+            (estimate.top3_errors, estimate.top1_errors),
+            (baseline['top3'], baseline['top1'])):
+        assert np.all(np.abs(p - np.array(p_baseline)) <=
+                      5.0 * errors + 1e-3)
@@ -0,0 +1,13 @@
+from standings import Standings, TeamIds
+
+
+def test_vector_of_team_without_games():
+    standings = Standings(TeamIds(), vectors=['wins'],
+                          matrices=['head_to_head'])
+    for i in range(16):
+        standings.add('wins', f'team{i}', i)
+
+    # A team which has not played yet is interned past the snapshot.
+    assert standings.vector('wins', ['team3', 'new']).tolist() == [3, 0]
+    assert standings.matrix('head_to_head', ['team3', 'new2']).tolist() == \
+        [[0, 0], [0, 0]]